@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+asyncplayer.py
+
+An alternative to player.Player with the same API, built around a single event loop thread instead of
+a lock shared by all threads. The loop owns two MPD connections, one for commands and one waiting in
+"idle", and multiplexes them with select(). Other threads hand it requests through a queue and get a
+CommandFuture back; the commands of a request are pipelined (sent without waiting for each answer) or
+sent as one command list. Answers and state refreshes are read only once they arrived, so command answers
+and state updates overlap, and no thread waits for another's lock.
+"""
+
+import os
+import random
+import select
+import logging
+import threading
+from collections import deque
+from mpd import *
+import tracing
+from tracing import monotonic
+from player import PlayerState, PlaybackClock, NO_STATE, CommandFuture
+
+logger = logging.getLogger()
+
+
+def buffered(client):
+    """
+    Tell whether data from MPD sits in the client's read buffer, where select() does not see it
+
+    :param client: connected MPDClient
+    :return: True if there is buffered data (or the buffer cannot be inspected)
+    """
+    rbuf = getattr(client._rfile, '_rbuf', None)  # socket._fileobject of Python 2
+    return rbuf is None or rbuf.tell() > 0
+
+
+class PendingRequest(object):
+    """A request sent to MPD, with the answers read so far"""
+
+    def __init__(self, future, commands, answers=None):
+        """
+        Constructor
+
+        :param future: CommandFuture of the request
+        :param commands: list of (command, args) tuples sent
+        :param answers: iterator over the answers of a command list, None if the commands were pipelined
+        """
+        self.future = future
+        self.commands = commands
+        self.answers = answers
+        self.results = []
+        self.error = None
+
+
+class AsyncPlayer(object):
+    """The class responsible for playing audio, driven by one event loop thread"""
+    current_playlistname = 'init'
+
+    retry_min = 0.5         # first reconnect delay (s)
+    retry_max = 30.0        # longest reconnect delay (s)
+    health_interval = 10.0  # seconds without traffic before the command connection is pinged
+    timeout = 10            # socket timeout of the connections, and how long blocking calls wait (s)
+
+    def __init__(self, host="localhost", port=6600):
+        """
+        Constructor. Connecting happens on the event loop thread, so this returns at once.
+        On the first connect the MPD database is updated and any existing playlists are cleared.
+
+        :param host: MPD host
+        :param port: MPD port
+        """
+        logger.debug("AsyncPlayer INIT")
+        self.conn_details = {"host": host, "port": port}
+        self.em_scene = None
+        self.pending_playlist = None  # card tapped while MPD was not connected, played on connect
+        self.initialized = False
+
+        self.state = NO_STATE
+        self.clock = PlaybackClock(NO_STATE)
+        self.state_listeners = []
+        self.connected = False
+        self.connection_listeners = []
+
+        # both connections are only used by the event loop thread
+        self.client = MPDClient()
+        self.idle_client = MPDClient()
+        self.queue = deque()   # [key, commands, future, command_list] lists waiting to be sent
+        self.queue_lock = threading.Lock()
+        self.pending = deque()  # PendingRequests sent, waiting for MPD's answers
+        self.refresh = None  # answers (status, currentsong) due on the idle connection, see send_refresh
+        self.wake_r, self.wake_w = os.pipe()
+
+        self.terminated = False
+        self.thread = threading.Thread(target=self.run, name="mpd-loop")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_state_listener(self, listener):
+        """
+        Register a function to be called with the new PlayerState whenever MPD state changes.
+        Listeners are called from the event loop thread.
+
+        :param listener: function taking a PlayerState as only argument
+        :return:
+        """
+        self.state_listeners.append(listener)
+
+    def add_connection_listener(self, listener):
+        """
+        Register a function to be called when the connection to MPD comes up or goes down.
+        Listeners are called from the event loop thread.
+
+        :param listener: function taking the new connected state (bool) as only argument
+        :return:
+        """
+        self.connection_listeners.append(listener)
+
+    def link_scene(self, scene):
+        """
+        Create a back link to the UI Scene object
+        :param scene:
+        :return:
+        """
+        self.em_scene = scene
+
+    def request(self, commands, key=None, command_list=False):
+        """
+        Have the event loop send commands to MPD (thread-safe). A request with a key replaces a queued,
+        not yet sent request with the same key.
+
+        :param commands: list of (command, args) tuples
+        :param key: identifies the request for coalescing, None to never coalesce
+        :param command_list: send the commands as one command list (a single answer) instead of pipelining them
+        :return: CommandFuture for the list of the commands' results; holds a ConnectionError at once
+                 if MPD is not connected
+        """
+        future = CommandFuture()
+        if not self.connected:
+            future.set_result(None, ConnectionError("not connected to MPD"))
+            return future
+        if logger.isEnabledFor(logging.DEBUG):
+            commands = commands + [('status', ()), ('currentsong', ())]
+        with self.queue_lock:
+            if key is not None:
+                for queued in self.queue:
+                    if queued[0] == key:
+                        queued[1] = commands
+                        queued[3] = command_list
+                        logger.debug("coalesced queued command %s" % (key,))
+                        return queued[2]
+            self.queue.append([key, commands, future, command_list])
+        os.write(self.wake_w, b'x')
+        return future
+
+    def submit(self, command, *args):
+        """
+        Run a player command ("pause", "next", "prev" or "stop") without waiting for it. A repeated
+        command still waiting in the queue is not sent twice: the queued one gets the new arguments.
+
+        :param command: name of the command
+        :param args: arguments for it
+        :return: CommandFuture for its result
+        """
+        if not self.connected:
+            return self.request([], key=command)  # fails at once
+        if command == 'pause':
+            commands = [('pause', tuple(a for a in args if a is not None))]
+        elif command in ('next', 'prev'):
+            if int(self.state.status.get('playlistlength', 0)) <= 1:
+                future = CommandFuture()
+                future.set_result(None)
+                return future
+            commands = [('next' if command == 'next' else 'previous', ())]
+        elif command == 'stop':
+            commands = [('stop', ()), ('clear', ())]
+        else:
+            raise ValueError("unknown player command %s" % command)
+        return self.request(commands, key=command)
+
+    def play(self, playlistname):
+        """
+        Play a playlist; waits for MPD's answer. If MPD is not connected, the playlist is played as soon
+        as it is.
+
+        :param playlistname: play the playlist with this name
+        :return:
+        """
+        if not self.connected:
+            logger.info("MPD not connected - playing %s once it is" % playlistname)
+            self.pending_playlist = playlistname
+            tracing.end("MPD not connected")
+            return
+        # the state snapshot tells whether this playlist is playing already - no need to ask MPD
+        if self.state.status['state'] == 'play' and self.current_playlistname == playlistname:
+            tracing.end("already playing")
+            return
+
+        self.current_playlistname = playlistname
+        # replace the playlist and start playing from the beginning, in a single round-trip
+        future = self.request([('clear', ()), ('load', (playlistname,)), ('play', ())], key='play',
+                              command_list=True)
+        try:
+            future.result(self.timeout)
+        except Exception as e:
+            logger.error("player.play(): could not play %s: %s" % (playlistname, e))
+            self.current_playlistname = 'init'
+            return
+        tracing.mark("play acknowledged")
+        self.em_scene.new_card(playlistname)
+
+    def pause(self, paused=None):
+        """
+        Pause or resume MPD; waits for MPD's answer
+
+        :param paused: 1 to pause, 0 to resume, None to toggle
+        :return:
+        """
+        self.submit('pause', paused).result(self.timeout)
+
+    def next(self):
+        """
+        Play next title in playlist; waits for MPD's answer
+
+        :return:
+        """
+        self.submit('next').result(self.timeout)
+
+    def prev(self):
+        """
+        Play previous Title in playlist; waits for MPD's answer
+
+        :return:
+        """
+        self.submit('prev').result(self.timeout)
+
+    def stop(self):
+        """
+        On stopping, reset the current playback and stop and clear the playlist; waits for MPD's answer
+
+        :return:
+        """
+        self.submit('stop').result(self.timeout)
+
+    def close(self):
+        """
+        Stop playback, the event loop and close the connections to MPD
+
+        :return:
+        """
+        logger.debug("player.close()")
+        if self.connected:
+            try:
+                self.stop()
+            except Exception as e:
+                logger.error("stopping MPD failed: %s" % e)
+        self.terminated = True
+        os.write(self.wake_w, b'x')
+        self.thread.join(self.timeout)
+
+    def set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if connected:
+            logger.info("connected to MPD")
+        elif not self.terminated:
+            logger.error("lost connection to MPD")
+        for listener in self.connection_listeners:
+            listener(connected)
+        if connected and self.pending_playlist is not None:
+            # play() waits for the loop, so it must not run on it
+            playlistname, self.pending_playlist = self.pending_playlist, None
+            thread = threading.Thread(target=self.play, args=(playlistname,))
+            thread.daemon = True
+            thread.start()
+
+    def set_state(self, state):
+        self.clock = PlaybackClock(state)
+        self.state = state
+        for listener in self.state_listeners:
+            listener(state)
+
+    def send_refresh(self):
+        """
+        Ask for status and currentsong on the idle connection as one command list, without waiting for
+        the answer: in iterate mode command_list_end() returns a generator that reads it once consumed
+
+        :return:
+        """
+        self.idle_client.command_list_ok_begin()
+        self.idle_client.status()
+        self.idle_client.currentsong()
+        self.idle_client.iterate = True
+        try:
+            self.refresh = self.idle_client.command_list_end()
+        finally:
+            self.idle_client.iterate = False
+
+    def fetch_refresh(self):
+        """
+        Read the answer to send_refresh() and store it as the new state snapshot
+
+        :return:
+        """
+        refresh, self.refresh = self.refresh, None
+        status, currentsong = list(refresh)
+        logger.debug("new player state: %s, %s" % (status, currentsong))
+        self.set_state(PlayerState(status, currentsong, monotonic()))
+
+    def refresh_state(self):
+        """
+        Fetch status and currentsong (in one round-trip, on the idle connection) and store them as the
+        new state snapshot; waits for the answer
+
+        :return:
+        """
+        self.send_refresh()
+        self.fetch_refresh()
+
+    def connect(self):
+        """
+        Connect both connections
+
+        :return: True on success
+        """
+        try:
+            self.client.connect(timeout=self.timeout, **self.conn_details)
+            self.idle_client.connect(timeout=self.timeout, **self.conn_details)
+            if not self.initialized:
+                self.client.update()
+                self.client.clear()
+                self.initialized = True
+            self.refresh_state()
+        except Exception as e:
+            logger.debug("connecting to MPD failed: %s" % e)
+            self.disconnect(e)
+            return False
+        self.set_connected(True)
+        return True
+
+    def disconnect(self, error):
+        """
+        Close both connections; all queued and pending requests fail with error
+
+        :param error: the exception that caused the disconnect
+        :return:
+        """
+        for client in (self.client, self.idle_client):
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        self.refresh = None
+        with self.queue_lock:
+            failed = [(future, None) for key, commands, future, command_list in self.queue]
+            self.queue.clear()
+        failed += [(request.future, None) for request in self.pending]
+        self.pending.clear()
+        for future, _ in failed:
+            future.set_result(None, error)
+        self.set_connected(False)
+        if self.state is not NO_STATE:
+            self.set_state(NO_STATE)  # nothing is known about MPD's state until it is back
+
+    def wait(self, timeout):
+        """
+        Wait for a wakeup (request or termination) at most timeout seconds
+
+        :param timeout: seconds
+        :return:
+        """
+        readable, _, _ = select.select([self.wake_r], [], [], timeout)
+        if readable:
+            os.read(self.wake_r, 4096)
+
+    def run(self):
+        """
+        Event loop: (re)connect with jittered exponential backoff, then serve until the connection fails
+
+        :return:
+        """
+        attempt = 0
+        while not self.terminated:
+            if not self.connect():
+                delay = min(self.retry_max, self.retry_min * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)  # jitter, so retries do not run in lockstep
+                attempt += 1
+                logger.error("Connection to MPD failed. Trying again in %.1f seconds." % delay)
+                self.wait(delay)
+                continue
+            attempt = 0
+            try:
+                self.serve()
+                self.disconnect(ConnectionError("player closed"))
+            except (MPDError, IOError) as e:
+                logger.error("MPD connection: %s - reconnecting" % e)
+                self.disconnect(e)
+
+    def serve(self):
+        """
+        Send queued requests, fetch their answers and refresh the state whenever idle reports a change,
+        until terminated. Answers are only read once their connection is readable.
+
+        :return:
+        """
+        self.idle_client.send_idle('player', 'playlist', 'mixer')
+        last_traffic = monotonic()
+        while not self.terminated:
+            timeout = self.health_interval - (monotonic() - last_traffic)
+            if timeout <= 0:
+                if not self.pending:  # a ping cannot be sent while answers are due
+                    self.client.send_ping()
+                    self.client.fetch_ping()
+                    last_traffic = monotonic()
+                    continue
+                timeout = self.health_interval
+
+            sockets = [self.wake_r, self.idle_client]
+            if self.pending:
+                sockets.append(self.client)
+            readable, _, _ = select.select(sockets, [], [], timeout)
+
+            if self.wake_r in readable:
+                os.read(self.wake_r, 4096)
+                self.send_requests()
+                last_traffic = monotonic()
+            if self.client in readable:
+                self.fetch_answers()
+                self.send_requests()  # those held back until the answers were in
+                last_traffic = monotonic()
+            if self.idle_client in readable:
+                if self.refresh is not None:
+                    self.fetch_refresh()
+                    self.idle_client.send_idle('player', 'playlist', 'mixer')
+                else:
+                    self.idle_client.fetch_idle()
+                    self.send_refresh()
+
+    def send_requests(self):
+        """
+        Send the queued requests without waiting for the answers. MPD answers a command list in one go,
+        and nothing else can be sent while its answer is due, so a command list waits in the queue (as
+        does everything after it) until all answers are in.
+
+        :return:
+        """
+        while True:
+            with self.queue_lock:
+                if not self.queue:
+                    return
+                key, commands, future, command_list = self.queue[0]
+                if self.pending and (command_list or self.pending[-1].answers is not None):
+                    return
+                self.queue.popleft()
+            request = PendingRequest(future, commands)
+            self.pending.append(request)  # fails with the others if sending fails
+            if command_list:
+                request.answers = self.send_command_list(commands)
+            else:
+                for command, args in commands:
+                    getattr(self.client, "send_" + command)(*args)
+
+    def send_command_list(self, commands):
+        """
+        Send commands as one command list, without waiting for the answer
+
+        :param commands: list of (command, args) tuples
+        :return: iterator over the commands' results, reading them as it goes
+        """
+        self.client.command_list_ok_begin()
+        for command, args in commands:
+            getattr(self.client, command)(*args)
+        self.client.iterate = True
+        try:
+            return self.client.command_list_end()
+        finally:
+            self.client.iterate = False
+
+    def log_state(self, commands, results):
+        if logger.isEnabledFor(logging.DEBUG) and len(results) >= 2 and commands[-1][0] == 'currentsong':
+            logger.debug("Status: %s" % results[-2])
+            logger.debug("currentsong: %s" % results[-1])
+
+    def fetch_answers(self):
+        """
+        Read the answers that arrived: one, and then those already sitting in the client's read buffer.
+        A request's future is set once all its answers are in.
+
+        :return:
+        """
+        while self.pending:
+            self.fetch_answer()
+            if not buffered(self.client):
+                return
+
+    def fetch_answer(self):
+        """
+        Read the answer to the next command of the first pending request
+
+        :return:
+        """
+        request = self.pending[0]
+        command, args = request.commands[len(request.results)]
+        try:
+            if request.answers is not None:
+                request.results.append(next(request.answers))
+            else:
+                request.results.append(getattr(self.client, "fetch_" + command)())
+        except CommandError as e:
+            if request.answers is not None:
+                # MPD stops a command list at the failing command, the error is its whole answer
+                self.pending.popleft()
+                request.future.set_result(None, e)
+                return
+            request.error = request.error or e
+            request.results.append(None)
+        if len(request.results) < len(request.commands):
+            return
+        if request.answers is not None:
+            for _ in request.answers:  # read the closing OK
+                pass
+        self.pending.popleft()
+        self.log_state(request.commands, request.results)
+        request.future.set_result(request.results, request.error)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Blit throughput of per-pixel alpha vs. display format view surfaces.
+
+Until views got surfaces in the display's pixel format, every view drew
+on a 32 bit surface with per-pixel alpha: each blit into the parent was
+alpha blended, and the scene was converted to the 16 bit framebuffer
+format of the PiTFT on every frame. This compares, per typical view
+size, those blits with the blits between display format surfaces, and
+the frame times of the bench_render scenes with both kinds of surfaces.
+
+The SDL 2 dummy driver always gives a 32 bit display, so a 16 bit
+surface (--depth) stands in for the framebuffer in the blit part; the
+scenes run at the display's format.
+
+    SDL_VIDEODRIVER=dummy python benchmarks/bench_blit.py --json out.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import bench_render
+from bench_render import ui, view, git_commit
+
+
+SIZES = [('screen', (320, 240)), ('cover', (320, 215)),
+         ('button', (64, 64)), ('label', (320, 28))]
+
+
+def blit_rate(src, dst, seconds):
+    """Blits of src onto dst per second"""
+    count = 0
+    start = time.time()
+    deadline = start + seconds
+    while True:
+        for i in range(50):
+            dst.blit(src, (0, 0))
+        count += 50
+        now = time.time()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def bench_blits(depth, seconds):
+    fb = pygame.Surface((320, 240), 0, depth)
+    rgba_parent = pygame.Surface((320, 240), pygame.SRCALPHA, 32)
+    results = {}
+    for name, size in SIZES:
+        rgba = pygame.Surface(size, pygame.SRCALPHA, 32)
+        rgba.fill((200, 100, 50, 255))
+        native = pygame.Surface(size, 0, fb)
+        native.fill((200, 100, 50))
+        pixels = size[0] * size[1]
+        rates = dict(rgba_to_rgba=blit_rate(rgba, rgba_parent, seconds),
+                     rgba_to_fb=blit_rate(rgba, fb, seconds),
+                     native_to_fb=blit_rate(native, fb, seconds))
+        results[name] = dict((k, dict(us=round(1e6 / r, 2),
+                                      mpixels_s=round(r * pixels / 1e6, 1)))
+                             for k, r in rates.items())
+    return results
+
+
+def bench_scenes(native):
+    opaque = view.View.__dict__['opaque']
+    if not native:
+        view.View.opaque = property(lambda self: False)
+    try:
+        results = {}
+        for name, timeline in bench_render.SCENES:
+            r = bench_render.run_scene(timeline())
+            results[name] = r['frame_ms']
+        return results
+    finally:
+        view.View.opaque = opaque
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--depth', type=int, default=16,
+                        help='bits per pixel of the framebuffer (default: 16)')
+    parser.add_argument('--seconds', type=float, default=0.5,
+                        help='duration of each blit measurement')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    ui.init('bench_blit', bench_render.WINDOW_SIZE)
+    results = dict(commit=git_commit(), pygame=pygame.version.ver,
+                   depth=args.depth,
+                   display_depth=ui.window_surface.get_bitsize(),
+                   blits=bench_blits(args.depth, args.seconds),
+                   scenes=dict(rgba=bench_scenes(False),
+                               native=bench_scenes(True)))
+
+    print('%d bit framebuffer, us per blit (Mpixels/s)' % args.depth)
+    print('%-8s %20s %20s %20s' % ('', 'rgba -> rgba', 'rgba -> fb',
+                                  'native -> fb'))
+    for name, _ in SIZES:
+        r = results['blits'][name]
+        print('%-8s' % name + ''.join(
+            '%12.1f (%5.0f)' % (r[k]['us'], r[k]['mpixels_s'])
+            for k in ('rgba_to_rgba', 'rgba_to_fb', 'native_to_fb')))
+    print('\n%d bit display, frame ms p50/p95' % results['display_depth'])
+    for name, _ in bench_render.SCENES:
+        rgba = results['scenes']['rgba'][name]
+        native = results['scenes']['native'][name]
+        print('%-8s rgba %6.2f/%6.2f   native %6.2f/%6.2f' % (
+            name, rgba['p50'], rgba['p95'], native['p50'], native['p95']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
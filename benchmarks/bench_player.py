@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Latency and throughput of the MPD players against the fake MPD server.
+
+Measures, for Player and AsyncPlayer and each answer latency of the
+fake server: how long a card tap takes to switch the playlist (play),
+how long a button command takes from submit to MPD's answer, how many
+commands per second get through to MPD, and how long a burst of button
+submits takes to settle (coalescing collapses it to a few commands).
+
+    python benchmarks/bench_player.py --latency 0 0.005 --json out.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from fakempd import FakeMPD
+from player import Player
+from asyncplayer import AsyncPlayer
+
+
+class NullScene(object):
+    def new_card(self, card_id):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summary(seconds):
+    return dict(p50_ms=round(percentile(seconds, 50) * 1000, 3),
+                p95_ms=round(percentile(seconds, 95) * 1000, 3),
+                max_ms=round(max(seconds) * 1000, 3))
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError('timed out')
+        time.sleep(0.001)
+
+
+def send_pause(player, paused):
+    """Have player send a pause command, without coalescing it."""
+    if isinstance(player, AsyncPlayer):
+        return player.request([('pause', (paused,))])
+    return player.commands.submit(player.call_mpd, (player.pause, paused))
+
+
+def bench(player_class, latency, count):
+    server = FakeMPD(port=0, latency=latency).start()
+    player = player_class(port=server.port)
+    player.link_scene(NullScene())
+    wait_for(lambda: player.connected)
+
+    plays = []
+    for i in range(count):
+        start = time.time()
+        player.play('card%d' % (i % 2))
+        plays.append(time.time() - start)
+    wait_for(lambda: player.state.status.get('playlistlength') == '3')
+
+    commands = []
+    for i in range(count):
+        start = time.time()
+        player.submit('pause', i % 2).result(10)
+        commands.append(time.time() - start)
+
+    sent = server.commands['pause']
+    start = time.time()
+    futures = [send_pause(player, i % 2) for i in range(count)]
+    for future in futures:
+        future.result(10)
+    throughput = (server.commands['pause'] - sent) / (time.time() - start)
+
+    sent = server.commands['pause']
+    start = time.time()
+    futures = [player.submit('pause', i % 2) for i in range(count)]
+    for future in futures:
+        future.result(10)
+    burst = time.time() - start
+    sent = server.commands['pause'] - sent
+
+    player.close()
+    server.stop()
+    return dict(player=player_class.__name__, latency_ms=latency * 1000,
+                play=summary(plays), command=summary(commands),
+                commands_per_s=round(throughput, 1),
+                burst_ms=round(burst * 1000, 3), burst_commands_sent=sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='plays/commands per measurement (default: 200)')
+    parser.add_argument('--latency', type=float, nargs='+',
+                        default=[0.0, 0.005],
+                        help='answer latencies of the fake MPD in seconds')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN)
+    results = []
+    for latency in args.latency:
+        for player_class in (Player, AsyncPlayer):
+            results.append(bench(player_class, latency, args.count))
+
+    print('%-12s %8s %16s %16s %10s %10s %5s' % (
+        '', 'latency', 'play p50/p95', 'command p50/p95', 'commands/s',
+        'burst', 'sent'))
+    row = '%-12s %6.1fms %7.2f/%6.2fms %7.2f/%6.2fms %10.1f %8.2fms %5d'
+    for r in results:
+        print(row % (
+            r['player'], r['latency_ms'],
+            r['play']['p50_ms'], r['play']['p95_ms'],
+            r['command']['p50_ms'], r['command']['p95_ms'],
+            r['commands_per_s'], r['burst_ms'], r['burst_commands_sent']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
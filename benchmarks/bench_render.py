@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""Headless render benchmark of pygameui scenes.
+
+Builds representative scenes, drives each through a scripted timeline
+of updates and input (at a fixed 60 Hz time step, as fast as possible)
+and measures every frame the way pygameui.run renders it: event
+dispatch, update and drawing of the damaged areas.
+
+    emma      the EmmaMusicScene layout: cover (a cached layer, now and
+              then one to be scaled by ImageView.layout), scrolling
+              title, play controls shown and hidden, a progress bar
+              filling up
+    list      a 200-item ListView (a cached layer) in a ScrollView,
+              scrolled and clicked
+    dialogs   stacked AlertViews and NotificationViews coming and going
+
+Reports per scene the p50/p95/p99 frame time, per view class the draw
+time (excluding children) and the surfaces it allocated, and the time
+spent in a few hot functions. --json writes the results, tagged with
+the git commit, for comparison across commits. --no-layers draws the
+scenes without cached layers.
+
+    SDL_VIDEODRIVER=dummy python benchmarks/bench_render.py --json a.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import pygame
+import pygameui as ui
+from pygameui import view, label, render, imageview
+
+
+DT = 1.0 / 60
+WINDOW_SIZE = (320, 240)
+
+# whether the scenes mark their static views as cached layers
+LAYERS = True
+
+
+# --- instrumentation
+
+class Stats(object):
+    """Draw time and surface allocations per view class"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.draw = {}        # class name -> [calls, seconds, surfaces, bytes]
+        self.functions = {}   # function name -> [calls, seconds]
+        self.stack = []       # [view, start, seconds in children]
+
+    def entry(self, name):
+        if name not in self.draw:
+            self.draw[name] = [0, 0.0, 0, 0]
+        return self.draw[name]
+
+
+stats = Stats()
+
+
+def instrument_draw(cls):
+    """Time cls.draw, excluding the time of child views' draw"""
+    original = cls.__dict__['draw']
+
+    def draw(self, *args, **kwargs):
+        if stats.stack and stats.stack[-1][0] is self:
+            return original(self, *args, **kwargs)   # super class draw
+        frame = [self, time.time(), 0.0]
+        stats.stack.append(frame)
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            stats.stack.pop()
+            elapsed = time.time() - frame[1]
+            entry = stats.entry(type(self).__name__)
+            entry[0] += 1
+            entry[1] += elapsed - frame[2]
+            if stats.stack:
+                stats.stack[-1][2] += elapsed
+
+    cls.draw = draw
+
+
+def instrument_function(owner, name, label_):
+    original = getattr(owner, name)
+    if isinstance(owner, type):
+        original = owner.__dict__[name]
+
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            entry = stats.functions.setdefault(label_, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.time() - start
+
+    setattr(owner, name, timed)
+
+
+_Surface = pygame.Surface
+
+
+class CountingSurface(_Surface):
+    """pygame.Surface counting allocations against the view drawing"""
+
+    def __init__(self, *args, **kwargs):
+        _Surface.__init__(self, *args, **kwargs)
+        if stats.stack:
+            name = type(stats.stack[-1][0]).__name__
+        else:
+            name = '(outside draw)'
+        entry = stats.entry(name)
+        entry[2] += 1
+        entry[3] += self.get_width() * self.get_height() * self.get_bytesize()
+
+
+def instrument():
+    classes = set()
+
+    def collect(cls):
+        for sub in cls.__subclasses__():
+            classes.add(sub)
+            collect(sub)
+
+    classes.add(view.View)
+    collect(view.View)
+    for cls in classes:
+        if 'draw' in cls.__dict__:
+            instrument_draw(cls)
+
+    instrument_function(label.Label, 'render', 'Label.render')
+    instrument_function(render, 'fill_gradient', 'fill_gradient')
+    instrument_function(imageview.ImageView, 'layout', 'ImageView.layout')
+    instrument_function(view.View, 'stylize', 'View.stylize')
+    pygame.Surface = CountingSurface
+
+
+# --- scenes and timelines
+
+def make_image(size, color):
+    surface = pygame.Surface(size)
+    surface.fill(color)
+    pygame.draw.circle(surface, (255, 255, 255),
+                       (size[0] // 2, size[1] // 2), min(size) // 3)
+    return surface
+
+
+def click(pos):
+    pygame.mouse.set_pos(pos)
+    ui.dispatch_event(pygame.event.Event(
+        pygame.MOUSEBUTTONDOWN, button=1, pos=pos))
+    ui.dispatch_event(pygame.event.Event(
+        pygame.MOUSEBUTTONUP, button=1, pos=pos))
+
+
+class EmmaScene(object):
+    """The EmmaMusicScene layout (without the player and the GPIO)"""
+
+    frames = 600
+
+    def build(self):
+        scene = ui.Scene()
+        self.covers = [make_image((320, 215), c)
+                       for c in ((120, 40, 40), (40, 120, 40))]
+        self.unscaled_cover = make_image((400, 300), (40, 40, 120))
+        self.background = ui.ImageButton(ui.Rect(0, 16, 320, 215),
+                                         self.covers[0])
+        self.background.cache_layer = LAYERS   # as in EmmaMusicScene
+        scene.add_child(self.background)
+        self.now_playing = ui.MarqueeLabel(
+            ui.Rect(0, 0, 320, ui.theme.current.label_height), '')
+        scene.add_child(self.now_playing)
+        icon = make_image((64, 64), (30, 30, 30))
+        self.buttons = []
+        for x in (20, 120, 220):
+            button = ui.ImageButton(ui.Rect(x, 88, 64, 64), icon)
+            button.hidden = True
+            scene.add_child(button)
+            self.buttons.append(button)
+        self.progress = ui.ProgressView(ui.Rect(0, 231, 320, 9))
+        scene.add_child(self.progress)
+        return scene
+
+    def step(self, i):
+        if i % 300 == 0:   # a new card
+            self.background.image_view.image = self.covers[(i // 300) % 2]
+            self.now_playing.text = (u'A rather long song title that does '
+                                     u'not fit and scrolls %d' % i)
+            self.progress.progress = 0.0
+        if i % 300 == 150:   # a cover not pre-scaled: scaled to fill
+            image_view = self.background.image_view
+            image_view.image = self.unscaled_cover
+            image_view.layout()
+        if i % 120 == 10:
+            for button in self.buttons:
+                button.hidden = False
+        if i % 120 == 70:
+            click(self.buttons[1].frame.center)
+        if i % 120 == 100:
+            for button in self.buttons:
+                button.hidden = True
+        self.progress.progress = min(1.0, (i % 300) / 300.0)
+
+
+class ListScene(object):
+    """A 200-item ListView in a ScrollView"""
+
+    frames = 600
+
+    def build(self):
+        scene = ui.Scene()
+        items = [ui.Label(ui.Rect(0, 0, 280, 20), 'Item %d' % i)
+                 for i in range(200)]
+        self.list_view = ui.ListView(ui.Rect(0, 0, 280, 0), items)
+        self.list_view.cache_layer = LAYERS
+        self.scroll_view = ui.ScrollView(ui.Rect(10, 10, 280, 200),
+                                         self.list_view)
+        scene.add_child(self.scroll_view)
+        return scene
+
+    def step(self, i):
+        offset = (i % 300) / 300.0
+        self.scroll_view.set_content_offset(0, offset)
+        if i % 30 == 15:
+            click((100, 100))
+
+
+class DialogScene(object):
+    """Stacked AlertViews and NotificationViews"""
+
+    frames = 600
+
+    def build(self):
+        self.scene = ui.Scene()
+        self.scene.add_child(ui.Label(ui.Rect(0, 0, 320, 240),
+                                      'background', wrap=ui.WORD_WRAP))
+        self.alerts = []
+        return self.scene
+
+    def step(self, i):
+        if i % 100 == 0:
+            alert = ui.AlertView('Alert %d' % i, 'Something happened that '
+                                 'needs a long explanation.', ui.OK)
+            alert.frame.topleft = (10 + len(self.alerts) * 20,
+                                   10 + len(self.alerts) * 20)
+            self.scene.add_child(alert)
+            self.alerts.append(alert)
+        if i % 100 == 50:
+            self.scene.add_child(ui.NotificationView('Notification %d' % i))
+        if i % 200 == 199:
+            while self.alerts:
+                self.alerts.pop().rm()
+
+
+SCENES = [('emma', EmmaScene), ('list', ListScene),
+          ('dialogs', DialogScene)]
+
+
+# --- measurement
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run_scene(timeline):
+    scene = timeline.build()
+    ui.scene.push(scene)
+    ui.draw_frame()   # first full frame, not measured
+    stats.reset()
+
+    frame_times = []
+    pixels = 0
+    for i in range(timeline.frames):
+        start = time.time()
+        timeline.step(i)
+        for e in pygame.event.get():
+            ui.dispatch_event(e)
+        ui._run_commands()
+        scene.update(DT)
+        pixels += ui.draw_frame()
+        frame_times.append(time.time() - start)
+    ui.scene.pop()
+
+    ms = [t * 1000 for t in frame_times]
+    return dict(
+        frames=len(ms),
+        frame_ms=dict(p50=round(percentile(ms, 50), 3),
+                      p95=round(percentile(ms, 95), 3),
+                      p99=round(percentile(ms, 99), 3),
+                      max=round(max(ms), 3),
+                      mean=round(sum(ms) / len(ms), 3)),
+        pixels_per_frame=pixels // len(ms),
+        draw=dict((name, dict(calls=e[0], self_ms=round(e[1] * 1000, 3),
+                              surfaces=e[2], surface_bytes=e[3]))
+                  for name, e in stats.draw.items()),
+        functions=dict((name, dict(calls=e[0], ms=round(e[1] * 1000, 3)))
+                       for name, e in stats.functions.items()))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+                                        'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(name, r):
+    f = r['frame_ms']
+    print('%s: %d frames, p50 %.2fms  p95 %.2fms  p99 %.2fms  max %.2fms, '
+          '%d pixels/frame' % (name, r['frames'], f['p50'], f['p95'],
+                               f['p99'], f['max'], r['pixels_per_frame']))
+    rows = sorted(r['draw'].items(), key=lambda kv: -kv[1]['self_ms'])
+    for cls, d in rows:
+        print('    %-22s %6d draws %9.2fms %6d surfaces %9d bytes' % (
+            cls, d['calls'], d['self_ms'], d['surfaces'],
+            d['surface_bytes']))
+    for fn, d in sorted(r['functions'].items()):
+        print('    %-22s %6d calls %9.2fms' % (fn, d['calls'], d['ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scene', action='append',
+                        choices=[name for name, _ in SCENES],
+                        help='scene(s) to run (default: all)')
+    parser.add_argument('--no-layers', action='store_true',
+                        help='do not cache static views as layers')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    global LAYERS
+    LAYERS = not args.no_layers
+    ui.init('bench_render', WINDOW_SIZE)
+    instrument()
+
+    results = dict(commit=git_commit(), pygame=pygame.version.ver,
+                   window=list(WINDOW_SIZE), layers=LAYERS, scenes={})
+    for name, timeline in SCENES:
+        if args.scene and name not in args.scene:
+            continue
+        results['scenes'][name] = run_scene(timeline())
+        print_results(name, results['scenes'][name])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Micro-benchmark of View.stylize on a scene of a few hundred views.
+
+Compares kvc.set_value_for_keypath (compiled, cached key paths and
+direct setattr for plain keys) with the former implementation, which
+split and regex-matched every key path on every call. Both set every
+key of the style, so unlike View.apply_style, which skips the keys
+already set, the figures only reflect the cost of the key path walks.
+
+    SDL_VIDEODRIVER=dummy python benchmarks/bench_stylize.py
+
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import pygameui as ui
+from pygameui import kvc
+from pygameui import view
+
+
+list_index_re = re.compile(r'([^\[]+)\[(\d+)\]')
+
+
+def _extract(val, key):
+    if isinstance(val, dict):
+        return val[key]
+    return getattr(val, key, None)
+
+
+def legacy_set_value_for_keypath(obj, path, new_value):
+    """kvc.set_value_for_keypath as it was before key paths were compiled"""
+    parts = path.split('.')
+    last_part = len(parts) - 1
+    dst = obj
+    for i, part in enumerate(parts):
+        match = re.match(list_index_re, part)
+        if match is not None:
+            dst = _extract(dst, match.group(1))
+            if not isinstance(dst, list) and not isinstance(dst, tuple):
+                raise TypeError('expected list/tuple')
+            index = int(match.group(2))
+            if i == last_part:
+                dst[index] = new_value
+            else:
+                dst = dst[index]
+        else:
+            if i != last_part:
+                dst = _extract(dst, part)
+            else:
+                if isinstance(dst, dict):
+                    dst[part] = new_value
+                else:
+                    setattr(dst, part, new_value)
+
+
+def legacy_apply_style(self, style):
+    for key, val in style.iteritems():
+        legacy_set_value_for_keypath(self, key, val)
+
+
+def compiled_apply_style(self, style):
+    for key, val in style.iteritems():
+        kvc.set_value_for_keypath(self, key, val)
+
+
+def build_scene(count):
+    scene = ui.Scene()
+    ui.scene.push(scene)
+    y = 0
+    for i in range(count // 4):
+        top = y % 200
+        scene.add_child(ui.Label(ui.Rect(0, top, 100, 20), 'label %d' % i))
+        scene.add_child(ui.Button(ui.Rect(100, top, 80, 20), 'b %d' % i))
+        scene.add_child(ui.Checkbox(ui.Rect(200, top, 80, 20), 'c %d' % i))
+        y += 20
+    for i in range(count // 20):
+        scene.add_child(ui.AlertView('title %d' % i, 'message', ui.OK))
+    return scene
+
+
+def count_views(v):
+    return 1 + sum(count_views(child) for child in v.children)
+
+
+def walk(v):
+    yield v
+    for child in v.children:
+        for descendant in walk(child):
+            yield descendant
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--views', type=int, default=300,
+                        help='approximate number of views (default: 300)')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    ui.init('bench_stylize', (320, 240))
+    scene = build_scene(args.views)
+    views = list(walk(scene))
+    styles = [(v, ui.theme.current.get_dict(v)) for v in views]
+
+    def apply_styles():
+        for v, style in styles:
+            v.apply_style(style)
+
+    current = view.View.apply_style
+    results = {}
+    for name, apply_style in (('legacy', legacy_apply_style),
+                              ('compiled', compiled_apply_style)):
+        view.View.apply_style = apply_style
+        results[name] = (best_of(apply_styles, args.repeat),
+                         best_of(scene.stylize, args.repeat))
+    view.View.apply_style = current
+
+    print('%d views' % count_views(scene))
+    print('%-10s %14s %14s' % ('', 'apply_style', 'stylize'))
+    for name in ('legacy', 'compiled'):
+        print('%-10s %12.2fms %12.2fms' % (name, results[name][0] * 1000,
+                                         results[name][1] * 1000))
+    print('%-10s %13.1fx %13.1fx' % (
+        'speedup', results['legacy'][0] / results['compiled'][0],
+        results['legacy'][1] / results['compiled'][1]))
+
+
+if __name__ == '__main__':
+    main()
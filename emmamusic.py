@@ -10,9 +10,11 @@ import pygame
 import signal
 import threading
 import time
-from rfidreader import RFIDReader
+from rfidreader import RFIDReader, PiRC522Backend
 import wiringpi2 as wiringpi
 from player import Player
+from asyncplayer import AsyncPlayer
+import tracing
 #from mpd import MPDClient
 #from threading import Lock
 
@@ -51,6 +53,12 @@ class EmmaMusicScene(ui.Scene):
     DIM_DARK=150
     DIM_SHUT=20
     IDLE_TIME=360000
+    TRACE_FILE = '/tmp/emmamusic-trace.jsonl'  # card tap latency traces are appended here on SIGUSR1
+    PROFILE_FILE = '/tmp/emmamusic-profile.json'  # view profile written here when SIGUSR2 turns profiling off
+    UPDATE_INTERVAL = 0.5  # seconds between updates while idle (progress bar, button and idle timeouts)
+    CONNECTING_TEXT = u'Connecting to MPD...'  # title shown while MPD is not connected
+    RFID_PIN_IRQ = None  # board pin of the RFID reader's IRQ line (IRQ mode), None if not connected (polling)
+    PAUSE_ON_REMOVE = False  # pause playback when the card is taken off the reader, resume when it is put back
 
     def __init__(self, player):
         """
@@ -68,19 +76,24 @@ class EmmaMusicScene(ui.Scene):
         # prepare signal handler for Ctrl+C and SIGTERM
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
+        tracing.install_signal_handler(self.TRACE_FILE)  # SIGUSR1 dumps card tap latency traces
+        ui.profiler.install_signal_handler(self.PROFILE_FILE)  # SIGUSR2 toggles the view profiler and overlay
+        self.tracing_cover = False  # True until the first frame showing a new cover was presented
 
         # init MPD Player Interface
         self.player = player
         self.player.link_scene(self)
+        self.player.add_state_listener(self.player_state_changed)
+        self.player.add_connection_listener(self.mpd_connection_changed)
 
         # init last action timestamp
         self.last_action_ts = pygame.time.get_ticks()
 
-        # load images
-        self.img_prev = ui.get_image('rewind-icon_s')
-        self.img_play = ui.get_image('play-icon_s')
-        self.img_pause = ui.get_image('pause-icon_s')
-        self.img_next = ui.get_image('forward-icon_s')
+        # load images (pinned, so they stay in the image cache)
+        self.img_prev = ui.pin_image('rewind-icon_s')
+        self.img_play = ui.pin_image('play-icon_s')
+        self.img_pause = ui.pin_image('pause-icon_s')
+        self.img_next = ui.pin_image('forward-icon_s')
 
         label_height = ui.theme.current.label_height
         scrollbar_size = ui.SCROLLBAR_SIZE
@@ -88,12 +101,14 @@ class EmmaMusicScene(ui.Scene):
         # create menu
         # create background image
         self.showing_splash = True  # remember we show splash screen image
-        self.background = ui.ImageButton(ui.Rect(0, 16, 320, 215), ui.get_image('splash', '/home/pi/music/images/'))
+        self.background = ui.ImageButton(ui.Rect(0, 16, 320, 215),
+                                         ui.pin_image('splash', '/home/pi/music/images/', (320, 215)))
         self.background.on_clicked.connect(self.button_click)
+        self.background.cache_layer = True  # the cover is redrawn only when it changes, not under the title or buttons
         self.add_child(self.background)
 
-        # create label for currently playing song
-        self.now_playing = ui.Label(ui.Rect(0, 0, 320, label_height), '')
+        # create label for currently playing song (long titles scroll)
+        self.now_playing = ui.MarqueeLabel(ui.Rect(0, 0, 320, label_height), '')
         self.add_child(self.now_playing)
 
         # create play control buttons (prev, play/pause, next)
@@ -105,6 +120,7 @@ class EmmaMusicScene(ui.Scene):
         self.add_child(self.btn_prev)
 
         self.playicon = True  # initially we show the play icon (False means show Pause Icon)
+        self.expected_state = None  # (player state when clicked, play state expected) until MPD reports back
         self.btn_play = ui.ImageButton(ui.Rect(120, 88, 64, 64), self.img_play)
         self.btn_play.on_clicked.connect(self.button_click)
         self.btn_play.hidden = True  # initially hidden
@@ -133,17 +149,28 @@ class EmmaMusicScene(ui.Scene):
 
     def new_card(self, card_id):
         """
-        A new RFID Card has been read by the rfid_reader and now we should play a new title
+        A new RFID Card has been read by the rfid_reader and now we should play a new title.
+        Called from the player's thread: the cover is decoded here, the scene is changed on the UI thread.
 
         :param card_id: the 4 byte ID of the RFID card in dotted decimal format. This will be the key to the playlist filename to play
         :return:
         """
+        # cover images are cached - a card played recently is shown without loading/scaling again
+        cover = ui.get_image(card_id, '/home/pi/music/images/', self.background.image_view.frame.size)
+        tracing.mark("cover decoded")
+        ui.call_soon(self.show_card, cover)
 
+    def show_card(self, cover):
+        """
+        Show the cover and the play controls of the card just played (on the UI thread)
+
+        :param cover: cover image surface
+        :return:
+        """
         self.last_action_ts = pygame.time.get_ticks()
-        # self.background.hidden=True
-        self.background.image_view.image = ui.get_image(card_id, '/home/pi/music/images/')
+        self.background.image_view.image = cover
+        self.tracing_cover = True
         self.showing_splash = False  # we no longer show the splash screen image
-        # self.background.hidden=False
         self.progress_view.hidden = False  # we play a song, so show progress bar
         self.show_buttons()  # show play controll buttons
 
@@ -195,24 +222,27 @@ class EmmaMusicScene(ui.Scene):
         self.last_action_ts = pygame.time.get_ticks()  # update last action timestamp (idle shutdown countdown restarts)
         self.show_time = pygame.time.get_ticks()  # refresh show time timestamp, so countdown restarts
 
-        status = self.player.get_status()
+        status = self.player.state.status
 
         # which button was pressed?
+        # player commands run on the player's command thread, the UI does not wait for MPD
         if btn is self.btn_play:
             logger.debug("button_click: btn_play ")
-            player.pause()  # toggle play/pause
+            pause = self.play_state() == 'play'  # toggle play/pause
+            self.expected_state = (self.player.state, 'pause' if pause else 'play')  # flip the icon right away
+            self.player.submit('pause', int(pause)).add_done_callback(self.command_done)
         elif btn is self.btn_prev:
             logger.debug("button_click: btn_prev ")
             try:
                 if int(status['song']) > 0:  # only accept 'prev' button push if this is not the first song
-                    player.prev()
+                    self.player.submit('prev').add_done_callback(self.command_done)
             except Exception as e:
                 logger.error(e, exc_info=True)  # log any exceptions
         elif btn is self.btn_next:
             logger.debug("button_click: btn_next ")
             try:
                 if int(status['song']) < (int(status['playlistlength']) - 1):
-                    player.next()
+                    self.player.submit('next').add_done_callback(self.command_done)
             except Exception as e:
                 logger.error(e, exc_info=True)  # log any exceptions
         elif btn is self.background:
@@ -222,6 +252,55 @@ class EmmaMusicScene(ui.Scene):
         else:
             logger.debug("button_click: <unknown>")
 
+    def play_state(self):
+        """
+        The play state to show: the one expected after a play/pause click until MPD reports a new state,
+        otherwise MPD's
+
+        :return: 'play', 'pause' or 'stop'
+        """
+        if self.expected_state is not None:
+            if self.expected_state[0] is self.player.state:
+                return self.expected_state[1]
+            self.expected_state = None
+        return self.player.state.status['state']
+
+    def command_done(self, future):
+        """
+        Called on the player's command thread when a command from a button click finished
+
+        :param future: CommandFuture of the command
+        :return:
+        """
+        if future.exception() is not None:
+            ui.call_soon(self.command_failed)
+
+    def command_failed(self):
+        """
+        A player command failed: show MPD's play state again instead of the expected one
+
+        :return:
+        """
+        self.expected_state = None
+
+    def player_state_changed(self, state):
+        """
+        Called by the player's MPD watcher thread when MPD status or current song changed
+
+        :param state: the new PlayerState snapshot
+        :return:
+        """
+        ui.wakeup()  # let the main loop pick up the new state right away
+
+    def mpd_connection_changed(self, connected):
+        """
+        Called by the player's connection thread when MPD got connected or disconnected
+
+        :param connected: True if MPD is connected now
+        :return:
+        """
+        ui.wakeup()  # show the connection state right away
+
     def update(self, dt):
         """
         update the UI - periodically called by main loop
@@ -231,27 +310,27 @@ class EmmaMusicScene(ui.Scene):
         """
 
         try:
-            status = player.get_status()  # get mpd status (playing, pause, etc.)
-            currentsong = player.get_currentsong()  # get current playing title details (name, time, etc.)
+            state = self.player.state  # cached MPD state, kept current by the player's watcher thread
+            status = state.status  # mpd status (playing, pause, etc.)
+            currentsong = state.currentsong  # current playing title details (name, time, etc.)
 
             # Update song title display
-            if 'title' in currentsong:
+            if not self.player.connected:
+                self.now_playing.text = self.CONNECTING_TEXT
+            elif 'title' in currentsong:
                 self.now_playing.text = unicode(currentsong['title'], "utf-8")
             else:
                 self.now_playing.text = None
 
-            # if we are playing, update progress bar
+            # if we are playing, let progress bar follow the player's playback clock (it updates itself)
             if status['state'] == 'play':
                 self.last_action_ts = pygame.time.get_ticks()  # while we play a music, update last active timestamp (i.e do not shutdown while playing)
-                progress = float(status['elapsed']) / float(currentsong['time'])
-                logger.debug("progress: {}".format(progress))
-                self.progress_view.progress = progress if (
-                    progress <= 1.0) else 1.0  # necessary due to precission issues at the end of a song
+                self.progress_view.clock = self.player.clock
             elif status['state'] == 'pause':
-                pass        #do not update if paused
+                self.progress_view.clock = self.player.clock  # paused clock, keeps progress where it is
             elif not self.showing_splash and self.now_playing.text == None:
                 # no song playing and not yet showing splash screen - load it and show it!
-                self.background.image_view.image = ui.get_image('splash', '/home/pi/music/images/')
+                self.background.image_view.image = ui.get_image('splash', '/home/pi/music/images/', (320, 215))
                 self.progress_view.hidden = True
                 self.showing_splash = True
                 self.hide_buttons()  # hide play buttons as we don't play any song
@@ -262,11 +341,12 @@ class EmmaMusicScene(ui.Scene):
 
             # update play/pause, etc. buttons if they should be visible
             if self.buttons_visible:
-                logger.debug("Status: %s, playicon= %s" % (status['state'], self.playicon))
-                if status['state'] != 'play' and self.playicon:  # not playing, but showing play icon - display pause
+                play_state = self.play_state()
+                logger.debug("Status: %s, playicon= %s" % (play_state, self.playicon))
+                if play_state != 'play' and self.playicon:  # not playing, but showing play icon - display pause
                     self.btn_play.image_view.image = self.img_pause
                     self.playicon = not self.playicon
-                elif status['state'] == 'play' and not self.playicon:  # other way around
+                elif play_state == 'play' and not self.playicon:  # other way around
                     self.btn_play.image_view.image = self.img_play
                     self.playicon = not self.playicon
 
@@ -279,6 +359,27 @@ class EmmaMusicScene(ui.Scene):
         except Exception as e:
             logger.error(e, exc_info=True)  # log any exceptions
 
+    def presented(self):
+        """
+        Called by the main loop after a frame was sent to the display
+
+        :return:
+        """
+        if self.tracing_cover:
+            self.tracing_cover = False
+            tracing.end("first frame")
+
+    def update_interval(self):
+        """
+        Tell the main loop how long it may sleep before the next update() call
+
+        :return: seconds until the next update is due (or less if a child view animates)
+        """
+        interval = ui.Scene.update_interval(self)
+        if interval is None or interval > self.UPDATE_INTERVAL:
+            interval = self.UPDATE_INTERVAL
+        return interval
+
     def signal_handler(self, signal, frame):
         """
         Handle any signals (SIGTERM, SIGHUP, etc.)
@@ -320,19 +421,37 @@ class EmmaMusicScene(ui.Scene):
 
 if __name__ == '__main__':
 
-    player = Player()  # create new player object (Lockable MPDClient)
+    if '--fake-mpd' in sys.argv:
+        from fakempd import FakeMPD
+        fake_mpd = FakeMPD().start()  # no MPD (or no audio hardware): serve a simulated one on localhost:6600
+
+    if '--async-mpd' in sys.argv:
+        player = AsyncPlayer()  # player driven by a single event loop thread
+    else:
+        player = Player()  # create new player object (Lockable MPDClient)
 
     ui.init('Raspberry Pi UI', (320, 240))  # init PiTFT UI and hide mouse icon
     pygame.mouse.set_visible(False)
 
+    # show covers from pre-scaled display format images; compile new/changed covers in the background
+    art_store = ui.ArtStore('/home/pi/music/images/', '/home/pi/music/images/320x215/', (320, 215))
+    ui.add_art_store(art_store)
+    art_compiler = threading.Thread(target=art_store.compile)
+    art_compiler.daemon = True
+    art_compiler.start()
+
     emscene = EmmaMusicScene(player)  # create new UI Scene, and pass reference to player object
 
     # start RFID Reader Thread
     rfidreader = RFIDReader(emscene,
-                            player)  # holds reference to UI for any updates and player to see directly launch a title TODO: can probably be simplified
+                            player,  # holds reference to UI for any updates and player to see directly launch a title TODO: can probably be simplified
+                            PiRC522Backend(pin_irq=EmmaMusicScene.RFID_PIN_IRQ),
+                            pause_on_remove=EmmaMusicScene.PAUSE_ON_REMOVE)
     threading.Thread(target=rfidreader).start()
 
     ui.scene.push(emscene)  # put UI on the screen
+    if logger.isEnabledFor(logging.DEBUG):
+        ui.profiler.enable(show_overlay=True)  # per view timings, FPS and top offenders in the corner
     ui.run()  # run main loop
 
     # shutdown procedure
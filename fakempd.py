@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+fakempd.py
+
+An in-process stand-in for MPD, speaking enough of its text protocol for the player: status,
+currentsong, clear, load, play, pause, stop, next, previous, idle/noidle, ping, update and command
+lists. Playback is only simulated (elapsed time runs while "playing"). Answers can be delayed and
+commands made to fail or drop the connection, to test and benchmark the player without MPD:
+
+    server = FakeMPD(port=0, latency=0.005).start()   # port 0: any free port, see server.port
+    player = Player(port=server.port)
+    ...
+    server.stop()
+
+Run this module to serve on localhost:6600, e.g. to run the UI on a machine without MPD:
+
+    python fakempd.py --latency 0.02 --failure-rate 0.01
+"""
+
+import time
+import shlex
+import random
+import select
+import socket
+import logging
+import threading
+from collections import Counter
+from tracing import monotonic
+
+logger = logging.getLogger()
+
+PROTOCOL_VERSION = "0.19.0"
+
+# MPD's ACK error codes
+ACK_ERROR_ARG = 2
+ACK_ERROR_NO_EXIST = 50
+ACK_ERROR_SYSTEM = 52
+ACK_ERROR_UNKNOWN = 5
+
+
+class CommandFailed(Exception):
+    """A command answered with ACK"""
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class FakeMPD(object):
+    """
+    Fake MPD server; each client connection is served by its own thread
+    """
+
+    def __init__(self, host="127.0.0.1", port=6600, playlists=None, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, disconnect_rate=0.0, seed=None):
+        """
+        Constructor
+
+        :param host: address to listen on
+        :param port: port to listen on, 0 for any free port
+        :param playlists: dictionary of playlist name to list of (title, seconds) songs; None to have
+                          any playlist name load three songs
+        :param latency: seconds each answer (of a command or a command list) is delayed
+        :param jitter: up to this many seconds are randomly added to the latency
+        :param failure_rate: probability of a command failing with an ACK (system error)
+        :param disconnect_rate: probability of the connection being closed instead of answering a command
+        :param seed: seed for the random failures and jitter
+        """
+        self.host = host
+        self.port = port
+        self.playlists = playlists
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.forced_failures = []  # modes ('ack' or 'disconnect') of the next commands to fail
+
+        self.commands = Counter()  # number of times each command was received
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.subscribers = []  # _Connections, collecting changed subsystems for idle
+
+        # simulated player state
+        self.playlist = []  # (title, seconds) songs
+        self.playlist_version = 1
+        self.state = 'stop'
+        self.song = 0
+        self.elapsed = 0.0  # at the time of self.started while playing
+        self.started = 0.0
+        self.volume = 100
+
+        self.sock = None
+        self.clients = []
+        self.terminated = False
+
+    def start(self):
+        """
+        Start listening and serving in background threads
+
+        :return: self
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.terminated = False
+        thread = threading.Thread(target=self.accept, name="fakempd")
+        thread.daemon = True
+        thread.start()
+        logger.info("fake MPD listening on %s:%d" % (self.host, self.port))
+        return self
+
+    def stop(self):
+        """
+        Stop listening and close all connections (like MPD going down)
+
+        :return:
+        """
+        self.terminated = True
+        for sock in [self.sock] + self.clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+        self.clients = []
+
+    def fail_next(self, count=1, disconnect=False):
+        """
+        Make the next commands fail
+
+        :param count: number of commands to fail
+        :param disconnect: close the connection instead of answering with an ACK
+        :return:
+        """
+        with self.lock:
+            self.forced_failures.extend(['disconnect' if disconnect else 'ack'] * count)
+
+    def accept(self):
+        while not self.terminated:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.clients.append(conn)
+            self.connections += 1
+            thread = threading.Thread(target=self.serve, args=(conn,), name="fakempd-client")
+            thread.daemon = True
+            thread.start()
+
+    # --- connection handling
+
+    def serve(self, conn):
+        """
+        Serve one client connection
+
+        :param conn: the client's socket
+        :return:
+        """
+        client = _Connection(conn)
+        with self.lock:
+            self.subscribers.append(client)
+        try:
+            client.send("OK MPD %s\n" % PROTOCOL_VERSION)
+            while not self.terminated:
+                line = client.readline()
+                if line is None:
+                    break
+                args = self.parse(line)
+                if not args:
+                    continue
+                if args[0] in ('command_list_begin', 'command_list_ok_begin'):
+                    commands = []
+                    while True:
+                        line = client.readline()
+                        if line is None:
+                            return
+                        if line == 'command_list_end':
+                            break
+                        commands.append(self.parse(line))
+                    self.run_commands(client, commands, args[0] == 'command_list_ok_begin')
+                elif args[0] == 'idle':
+                    self.idle(client, args[1:])
+                elif args[0] == 'noidle':
+                    continue  # idle ended before the client's noidle arrived
+                elif args[0] == 'close':
+                    break
+                else:
+                    self.run_commands(client, [args], False, single=True)
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                self.subscribers.remove(client)
+            if conn in self.clients:
+                self.clients.remove(conn)
+            conn.close()
+
+    def parse(self, line):
+        try:
+            return shlex.split(line)
+        except ValueError:
+            return [line]
+
+    def run_commands(self, client, commands, list_ok, single=False):
+        """
+        Run a command or a command list and answer it (after the configured latency)
+
+        :param client: the _Connection
+        :param commands: list of parsed commands (lists of command and arguments)
+        :param list_ok: answer each command of the list with list_OK
+        :param single: a single command, not a list
+        :return:
+        """
+        out = []
+        for index, args in enumerate(commands):
+            mode = self.injected_failure()
+            if mode == 'disconnect':
+                client.close()
+                return
+            try:
+                if mode == 'ack':
+                    raise CommandFailed(ACK_ERROR_SYSTEM, "injected failure")
+                out.extend(self.run(args))
+            except CommandFailed as e:
+                out.append("ACK [%d@%d] {%s} %s\n" % (e.code, 0 if single else index, args[0], e))
+                break
+            if list_ok:
+                out.append("list_OK\n")
+        else:
+            out.append("OK\n")
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        client.send("".join(out))
+
+    def injected_failure(self):
+        """
+        :return: 'ack' or 'disconnect' if the next command shall fail, None otherwise
+        """
+        with self.lock:
+            if self.forced_failures:
+                return self.forced_failures.pop(0)
+            if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+                return 'disconnect'
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                return 'ack'
+        return None
+
+    def idle(self, client, subsystems):
+        """
+        Wait until one of the subsystems changed or the client sends noidle. Like MPD, changes since
+        the client's previous idle are reported at once.
+
+        :param client: the _Connection
+        :param subsystems: subsystems to wait for, all if empty
+        :return:
+        """
+        self.commands['idle'] += 1
+        with self.lock:
+            client.wanted = set(subsystems)
+            if client.matching_changes():
+                client.event.set()
+        try:
+            while not self.terminated and not client.event.is_set():
+                if client.poll(0.05):
+                    line = client.readline()
+                    if line is None:
+                        return
+                    if line == 'noidle':
+                        break
+        finally:
+            with self.lock:
+                changed = client.matching_changes()
+                client.changed -= changed
+                client.wanted = None
+                client.event.clear()
+        client.send("".join("changed: %s\n" % s for s in sorted(changed)) + "OK\n")
+
+    def notify(self, *subsystems):
+        # call with self.lock held
+        for client in self.subscribers:
+            client.changed.update(subsystems)
+            if client.wanted is not None and client.matching_changes():
+                client.event.set()
+
+    # --- commands
+
+    def run(self, args):
+        """
+        Run one command
+
+        :param args: command and arguments
+        :return: list of answer lines
+        """
+        command = args[0]
+        self.commands[command] += 1
+        handler = getattr(self, "cmd_" + command, None)
+        if handler is None:
+            raise CommandFailed(ACK_ERROR_UNKNOWN, 'unknown command "%s"' % command)
+        with self.lock:
+            try:
+                return handler(*args[1:]) or []
+            except (TypeError, ValueError):
+                raise CommandFailed(ACK_ERROR_ARG, "wrong arguments")
+
+    def position(self):
+        if self.state == 'play':
+            return self.elapsed + monotonic() - self.started
+        return self.elapsed
+
+    def set_state(self, state, song=None, elapsed=None):
+        if self.state == 'play':
+            self.elapsed = self.position()
+        if song is not None:
+            self.song = song
+        if elapsed is not None:
+            self.elapsed = elapsed
+        self.state = state
+        self.started = monotonic()
+        self.notify('player')
+
+    def cmd_ping(self):
+        pass
+
+    def cmd_status(self):
+        lines = ["volume: %d\n" % self.volume, "repeat: 0\n", "random: 0\n", "single: 0\n", "consume: 0\n",
+                 "playlist: %d\n" % self.playlist_version, "playlistlength: %d\n" % len(self.playlist),
+                 "state: %s\n" % self.state]
+        if self.state != 'stop' and self.playlist:
+            duration = self.playlist[self.song][1]
+            elapsed = self.position()
+            lines += ["song: %d\n" % self.song, "songid: %d\n" % (self.song + 1),
+                      "time: %d:%d\n" % (elapsed, duration), "elapsed: %.3f\n" % elapsed,
+                      "duration: %.3f\n" % duration]
+        return lines
+
+    def cmd_currentsong(self):
+        if not self.playlist:
+            return []
+        title, duration = self.playlist[self.song]
+        return ["file: %s.mp3\n" % title, "Title: %s\n" % title, "Time: %d\n" % duration,
+                "duration: %.3f\n" % duration, "Pos: %d\n" % self.song, "Id: %d\n" % (self.song + 1)]
+
+    def cmd_clear(self):
+        self.playlist = []
+        self.playlist_version += 1
+        self.set_state('stop', 0, 0.0)
+        self.notify('playlist')
+
+    def cmd_load(self, name):
+        if self.playlists is None:
+            songs = [("%s - Track %d" % (name, i + 1), 180) for i in range(3)]
+        elif name in self.playlists:
+            songs = list(self.playlists[name])
+        else:
+            raise CommandFailed(ACK_ERROR_NO_EXIST, "No such playlist")
+        self.playlist.extend(songs)
+        self.playlist_version += 1
+        self.notify('playlist')
+
+    def cmd_play(self, pos=None):
+        if not self.playlist:
+            return
+        song = int(pos) if pos is not None else (self.song if self.state != 'stop' else 0)
+        if not 0 <= song < len(self.playlist):
+            raise CommandFailed(ACK_ERROR_ARG, "Bad song index")
+        self.set_state('play', song, 0.0)
+
+    def cmd_pause(self, paused=None):
+        if self.state == 'stop':
+            return
+        if paused is None:
+            paused = self.state == 'play'
+        self.set_state('pause' if int(paused) else 'play')
+
+    def cmd_stop(self):
+        self.set_state('stop', elapsed=0.0)
+
+    def cmd_next(self):
+        if self.state == 'stop':
+            return
+        if self.song + 1 < len(self.playlist):
+            self.set_state(self.state, self.song + 1, 0.0)
+        else:
+            self.set_state('stop', 0, 0.0)
+
+    def cmd_previous(self):
+        if self.state == 'stop':
+            return
+        self.set_state(self.state, max(self.song - 1, 0), 0.0)
+
+    def cmd_update(self, path=None):
+        self.notify('update', 'database')
+        return ["updating_db: 1\n"]
+
+    def cmd_setvol(self, volume):
+        self.volume = int(volume)
+        self.notify('mixer')
+
+
+class _Connection(object):
+    """Line based reading and writing on a client socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ""
+        self.changed = set()  # subsystems changed since the last idle
+        self.wanted = None  # subsystems waited for while in idle (empty: all), None when not in idle
+        self.event = threading.Event()  # set when a wanted subsystem changed
+
+    def matching_changes(self):
+        """
+        :return: the changed subsystems the client waits for
+        """
+        if not self.wanted:
+            return set(self.changed)
+        return self.changed & self.wanted
+
+    def poll(self, timeout):
+        """
+        :return: True if a line (or the end of the connection) can be read without blocking
+        """
+        if "\n" in self.buffer:
+            return True
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def readline(self):
+        """
+        :return: the next line without the line end, None at the end of the connection
+        """
+        while "\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split("\n", 1)
+        return line.strip()
+
+    def send(self, text):
+        self.sock.sendall(text)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a fake MPD (no audio) for running the player without MPD.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6600)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each answer is delayed')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra delay up to this many seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability of a command failing')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help='probability of the connection being dropped on a command')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeMPD(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                     failure_rate=args.failure_rate, disconnect_rate=args.disconnect_rate).start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.stop()
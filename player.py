@@ -12,13 +12,92 @@ __version_info__ = (0, 0, 2)
 __version__ = '.'.join(map(str, __version_info__))
 __author__ = "David Hamann based on work of Willem van der Jagt"
 import time
+import random
+import select
 import logging
+import threading
+from collections import namedtuple, deque
 from mpd import *
 from threading import Lock
+import tracing
+from tracing import monotonic
 
 logger = logging.getLogger()
 
 
+class PlayerState(namedtuple('PlayerState', ['status', 'currentsong', 'timestamp'])):
+    """
+    Snapshot of the MPD state as of `timestamp` (see monotonic()).
+
+    A snapshot is replaced as a whole whenever MPD reports a change and is never modified afterwards,
+    so readers on any thread can use it without locking. Do not modify the status/currentsong dicts.
+    """
+    __slots__ = ()
+
+
+NO_STATE = PlayerState({'state': 'stop'}, {}, 0.0)
+
+
+class PlaybackClock(object):
+    """
+    Local estimate of the playback position, built from a PlayerState snapshot.
+
+    MPD reports the elapsed time only when its state changes; while playing, the clock adds the
+    (monotonic) time passed since the snapshot was taken. So reading it needs no MPD round-trip.
+    """
+
+    def __init__(self, state):
+        """
+        Constructor
+
+        :param state: PlayerState snapshot to start from
+        """
+        status = state.status
+        self.playing = status.get('state') == 'play'
+        self.start_elapsed = float(status.get('elapsed', 0.0))
+        # 'duration' is only reported by MPD >= 0.20, older versions only have the song's 'time'
+        self.duration = float(status.get('duration') or state.currentsong.get('time') or 0.0)
+        self.timestamp = state.timestamp
+
+    def elapsed(self, now=None):
+        """
+        Seconds played of the current song
+
+        :param now: monotonic() timestamp to get the elapsed time for, defaults to now
+        :return: elapsed seconds, never more than the song duration (if known)
+        """
+        elapsed = self.start_elapsed
+        if self.playing:
+            if now is None:
+                now = monotonic()
+            elapsed += now - self.timestamp
+        if self.duration > 0:
+            elapsed = min(elapsed, self.duration)
+        return elapsed
+
+    def progress(self, now=None):
+        """
+        Part of the current song played
+
+        :param now: monotonic() timestamp to get the progress for, defaults to now
+        :return: progress in the range [0, 1] (0 if the duration is unknown)
+        """
+        if self.duration <= 0:
+            return 0.0
+        return self.elapsed(now) / self.duration
+
+    def time_until(self, progress):
+        """
+        Seconds until playback reaches the given progress
+
+        :param progress: progress in the range [0, 1]
+        :return: seconds (0 if already reached), None if it will not be reached without a state change
+        """
+        if not self.playing or self.duration <= 0 or progress > 1.0:
+            return None
+        return max(0.0, progress * self.duration - self.elapsed())
+
+
 class LockableMPDClient(MPDClient):
     """
     Simple implementation of a thread safe version of the MPDCLient Class
@@ -70,23 +149,437 @@ class LockableMPDClient(MPDClient):
         self.release()
 
 
+class CommandFuture(object):
+    """
+    Result of a command run by the CommandExecutor; callbacks are called on the executor's thread
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._lock = Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the command to finish
+
+        :param timeout: seconds to wait at most (wait forever if None)
+        :return: what the command returned; raises what the command raised
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("command not done after %s s" % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self):
+        """
+        :return: the exception the finished command raised, None if there was none
+        """
+        return self._error
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(future) once the command finished (at once if it already did)
+
+        :param callback: function taking this future as only argument
+        :return:
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error("command callback failed: %s" % e, exc_info=True)
+
+
+class CommandExecutor(object):
+    """
+    Runs commands one after another on a worker thread, so callers (e.g. the UI) never wait for MPD.
+
+    A command submitted with a key replaces a queued, not yet started command with the same key: the
+    command runs once, with the latest arguments, and both callers get the same future.
+    """
+
+    def __init__(self, name="mpd-commands"):
+        """
+        Constructor
+
+        :param name: name of the worker thread
+        """
+        self.queue = deque()  # [key, function, args, future] lists
+        self.condition = threading.Condition()
+        self.terminated = False
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, args=(), key=None):
+        """
+        Queue a command
+
+        :param function: function to call on the worker thread
+        :param args: arguments to call it with
+        :param key: identifies the command for coalescing, None to never coalesce
+        :return: CommandFuture for the function's result
+        """
+        with self.condition:
+            if key is not None:
+                for command in self.queue:
+                    if command[0] == key:
+                        command[1] = function
+                        command[2] = args
+                        logger.debug("coalesced queued command %s" % (key,))
+                        return command[3]
+            future = CommandFuture()
+            self.queue.append([key, function, args, future])
+            self.condition.notify()
+        return future
+
+    def run(self):
+        """
+        Worker thread main loop
+
+        :return:
+        """
+        while True:
+            with self.condition:
+                while not self.queue and not self.terminated:
+                    self.condition.wait()
+                if self.terminated:
+                    break
+                key, function, args, future = self.queue.popleft()
+            try:
+                result = function(*args)
+            except Exception as e:
+                logger.error("command %s failed: %s" % (key or function.__name__, e))
+                future.set_result(None, e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self):
+        """
+        Stop the worker thread; queued commands are dropped
+
+        :return:
+        """
+        with self.condition:
+            self.terminated = True
+            self.queue.clear()
+            self.condition.notify()
+
+
+class MPDConnection(object):
+    """
+    Keeps an MPD client connected, without blocking anyone: a background thread connects, retrying with
+    jittered exponential backoff, and checks the live connection with "ping" every health_interval seconds.
+    """
+
+    retry_min = 0.5         # first retry delay (s)
+    retry_max = 30.0        # longest retry delay (s)
+    health_interval = 10.0  # seconds between pings while connected
+    timeout = 10            # socket timeout of the connection (s)
+
+    def __init__(self, client, conn_details, on_connect=None, on_check=None):
+        """
+        Constructor
+
+        :param client: LockableMPDClient to keep connected
+        :param conn_details: host and port to connect to
+        :param on_connect: function called with the client (lock held) after each successful connect
+        :param on_check: function called (lock not held) after each successful health check
+        """
+        self.client = client
+        self.conn_details = conn_details
+        self.on_connect = on_connect
+        self.on_check = on_check
+        self.connected = False
+        self.listeners = []
+        self.terminated = False
+        self._check = threading.Event()
+        self._connected = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="mpd-connection")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_listener(self, listener):
+        """
+        Register a function to be called when the connection comes up or goes down.
+        Listeners are called from the connection thread.
+
+        :param listener: function taking the new connected state (bool) as only argument
+        :return:
+        """
+        self.listeners.append(listener)
+
+    def wait_connected(self, timeout=None):
+        """
+        Wait until MPD is connected
+
+        :param timeout: seconds to wait at most (wait forever if None)
+        :return: True if connected
+        """
+        return self._connected.wait(timeout)
+
+    def connection_lost(self):
+        """
+        Report a command failing with a connection error: the connection is checked at once
+
+        :return:
+        """
+        self._check.set()
+
+    def set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if connected:
+            logger.info("connected to MPD")
+            self._connected.set()
+        else:
+            logger.error("lost connection to MPD")
+            self._connected.clear()
+        for listener in self.listeners:
+            listener(connected)
+
+    def connect(self):
+        """
+        Connect the client and run on_connect
+
+        :return: True on success
+        """
+        with self.client:
+            try:
+                self.client.connect(timeout=self.timeout, **self.conn_details)
+                if self.on_connect is not None:
+                    self.on_connect(self.client)
+            except Exception as e:
+                logger.debug("connecting to MPD failed: %s" % e)
+                self.disconnect()
+                return False
+        self.set_connected(True)
+        return True
+
+    def ping(self):
+        """
+        Check the connection
+
+        :return: True if MPD answered
+        """
+        with self.client:
+            try:
+                self.client.ping()
+                return True
+            except Exception as e:
+                logger.error("MPD health check failed: %s" % e)
+                self.disconnect()
+                return False
+
+    def disconnect(self):
+        # call with the client's lock held
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    def run(self):
+        """
+        Connection thread main loop
+
+        :return:
+        """
+        attempt = 0
+        while not self.terminated:
+            if not self.connected:
+                if self.connect():
+                    attempt = 0
+                    continue
+                delay = min(self.retry_max, self.retry_min * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)  # jitter, so retries do not run in lockstep
+                attempt += 1
+                logger.error("Connection to MPD failed. Trying again in %.1f seconds." % delay)
+                self._check.wait(delay)
+                self._check.clear()
+            else:
+                self._check.wait(self.health_interval)
+                self._check.clear()
+                if self.terminated:
+                    continue
+                if not self.ping():
+                    self.set_connected(False)
+                elif self.on_check is not None:
+                    self.on_check()
+
+    def close(self):
+        """
+        Stop the connection thread (the client stays connected)
+
+        :return:
+        """
+        self.terminated = True
+        self._check.set()
+
+
 class Player(object):
     """The class responsible for playing audio"""
     current_playlistname = 'init'
 
-    def __init__(self):
+    def __init__(self, host="localhost", port=6600):
         """Setup a connection to MPD to be able to play audio.
 
-        Also update the MPD database with any new MP3 files that may have been added
-        and clear any existing playlists.
+        Connecting happens in the background, so this returns at once even if MPD is not up yet.
+        On the first connect the MPD database is updated with any new MP3 files that may have been added
+        and any existing playlists are cleared.
+
+        :param host: MPD host
+        :param port: MPD port
         """
 
         logger.debug("Player INIT")
         self.mpd_client = LockableMPDClient()
-        self.conn_details = {"host": "localhost", "port": 6600}
-        self.init_mpd()
-
+        self.conn_details = {"host": host, "port": port}
         self.em_scene = None
+        self.pending_playlist = None  # card tapped while MPD was not connected, played on connect
+        self.initialized = False
+
+        # commands from the UI run on their own thread
+        self.commands = CommandExecutor()
+
+        # connect in the background
+        self.connection = MPDConnection(self.mpd_client, self.conn_details, self.init_mpd, self.play_pending)
+        self.connection.add_listener(self.connection_changed)
+
+        # MPD state cache, kept up to date by the watcher thread using MPD's idle command
+        self.state = NO_STATE
+        self.clock = PlaybackClock(NO_STATE)
+        self.state_listeners = []
+        self.watcher_terminated = False
+        self.watcher = threading.Thread(target=self.watch_mpd, name="mpd-watcher")
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def add_state_listener(self, listener):
+        """
+        Register a function to be called with the new PlayerState whenever MPD state changes.
+        Listeners are called from the watcher thread.
+
+        :param listener: function taking a PlayerState as only argument
+        :return:
+        """
+        self.state_listeners.append(listener)
+
+    def add_connection_listener(self, listener):
+        """
+        Register a function to be called when the connection to MPD comes up or goes down.
+        Listeners are called from the connection thread.
+
+        :param listener: function taking the new connected state (bool) as only argument
+        :return:
+        """
+        self.connection.add_listener(listener)
+
+    def refresh_state(self, client):
+        """
+        Fetch status and currentsong, store them as the new state snapshot and notify listeners
+
+        :param client: MPDClient connection to use (owned by the calling thread)
+        :return:
+        """
+        status = client.status()
+        currentsong = client.currentsong()
+        state = PlayerState(status, currentsong, monotonic())
+        self.clock = PlaybackClock(state)
+        self.state = state
+        logger.debug("new player state: %s, %s" % (status, currentsong))
+        for listener in self.state_listeners:
+            listener(self.state)
+
+    def watch_mpd(self):
+        """
+        Watcher thread main loop. Uses a separate MPD connection which waits in
+        "idle player playlist mixer" and refreshes the state snapshot whenever MPD reports a change
+
+        :return:
+        """
+        client = MPDClient()
+        while not self.watcher_terminated:
+            if not self.connection.wait_connected(1.0):
+                continue
+            try:
+                client.connect(**self.conn_details)
+                self.refresh_state(client)
+                while not self.watcher_terminated:
+                    client.send_idle('player', 'playlist', 'mixer')
+                    # wait with timeout, so we notice when we shall terminate
+                    while not self.watcher_terminated:
+                        readable, _, _ = select.select([client], [], [], 1.0)
+                        if readable:
+                            client.fetch_idle()
+                            self.refresh_state(client)
+                            break
+                    else:
+                        client.noidle()
+                client.disconnect()
+            except Exception as e:
+                logger.error("MPD watcher: %s - reconnecting" % e)
+                try:
+                    client.disconnect()
+                except Exception:
+                    pass
+                self.connection.connection_lost()
+                if self.state is not NO_STATE:
+                    # nothing is known about MPD's state until it is back
+                    self.state = NO_STATE
+                    self.clock = PlaybackClock(NO_STATE)
+                    for listener in self.state_listeners:
+                        listener(self.state)
+                time.sleep(1)
+
+    def submit(self, command, *args):
+        """
+        Run a player command (e.g. "pause", "next") on the command thread. A repeated command still waiting
+        in the queue is not run twice: the queued one gets the new arguments. While MPD is not connected
+        the command is rejected at once: the returned future holds a ConnectionError.
+
+        :param command: name of the Player method to call
+        :param args: arguments for it
+        :return: CommandFuture for its result
+        """
+        if not self.connected:
+            future = CommandFuture()
+            future.set_result(None, ConnectionError("not connected to MPD"))
+            return future
+        return self.commands.submit(self.call_mpd, (getattr(self, command),) + args, key=command)
+
+    def call_mpd(self, function, *args):
+        """
+        Call a player method, reporting connection errors to the connection manager
+
+        :param function: Player method
+        :param args: arguments for it
+        :return: what the method returns
+        """
+        try:
+            return function(*args)
+        except (ConnectionError, IOError):
+            self.connection.connection_lost()
+            raise
 
     def link_scene(self, scene):
         """
@@ -96,39 +589,47 @@ class Player(object):
         """
         self.em_scene = scene
 
-    def init_mpd(self):
+    @property
+    def connected(self):
+        """
+        :return: True while there is a connection to MPD
+        """
+        return self.connection.connected
+
+    def init_mpd(self, client):
         """
-        Initialize the MPDClient Object
+        Prepare MPD after connecting (called by the connection thread with the client's lock held)
 
+        :param client: the connected MPDClient
         :return:
         """
-        try:
-            logger.debug("Connecting to MPD.")
-            with self.mpd_client:
-                self.mpd_client.connect(**self.conn_details)
+        if not self.initialized:
+            client.update()
+            client.clear()
+            # client.setvol(100)
+            self.initialized = True
 
-                self.mpd_client.update()
-                self.mpd_client.clear()
-                # self.mpd_client.setvol(100)
-        except:
-            logger.error("Connection to MPD failed. Trying again in 10 seconds.")
-            time.sleep(10)
-            self.init_mpd(conn_details)
+    def connection_changed(self, connected):
+        """
+        Called by the connection thread when the connection to MPD came up or went down
+
+        :param connected: True if MPD is connected now
+        :return:
+        """
+        if connected:
+            self.play_pending()
 
-    def connect_mpd(self):
+    def play_pending(self):
         """
-        Connect MPD Client to MPD Server
+        Play the playlist of a card tapped while MPD could not be reached. Called by the connection thread
+        when the connection came up, and after each health check it passed: a play failing with a
+        connection error triggers a check, which need not find the connection down.
 
         :return:
         """
-        try:
-            self.mpd_client.connect(**self.conn_details)
-        except ConnectionError as e:
-            logger.debug("ConnectionError Exception: " + e.args[0])
-            if e.args[0] == "Already connected":
-                logger.debug("Already connected")
-            else:
-                logger.error("Failed to Connect to MPD")
+        if self.pending_playlist is not None:
+            playlistname, self.pending_playlist = self.pending_playlist, None
+            self.commands.submit(self.play, (playlistname,), key='play')
 
     def stop(self):
         """
@@ -140,47 +641,83 @@ class Player(object):
             self.mpd_client.stop()
             self.mpd_client.clear()
 
-    def play(self, playlistname, retry=0):
+    def send_command_list(self, *commands):
+        """
+        Send commands to MPD as one command list, i.e. in a single round-trip. Hold the client's lock
+        when calling this. With debug logging on, status and currentsong are fetched (and logged) in the
+        same list.
+
+        :param commands: command names, or (name, argument, ...) tuples
+        :return: list of the commands' results
         """
-        Play a playlist
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            commands += ('status', 'currentsong')
+        client = self.mpd_client
+        client.command_list_ok_begin()
+        for command in commands:
+            if isinstance(command, tuple):
+                getattr(client, command[0])(*command[1:])
+            else:
+                getattr(client, command)()
+        results = client.command_list_end()
+        if debug:
+            logger.debug("Status: %s" % results[-2])
+            logger.debug("currentsong: %s" % results[-1])
+            results = results[:-2]
+        return results
+
+    def play(self, playlistname):
+        """
+        Play a playlist. If MPD is not connected, the playlist is played as soon as it is.
 
         :param playlistname: play the playlist with this name
-        :param retry:  retry count (used for recursive calling of this method - stop after a certian amount of retries)
         :return:
         """
+        if not self.connected:
+            logger.info("MPD not connected - playing %s once it is" % playlistname)
+            self.pending_playlist = playlistname
+            tracing.end("MPD not connected")
+            return
 
-        # order of try and with is important - otherwise retry will block due to Locking
         try:
+            started = False
             with self.mpd_client:
-                if not (self.mpd_client.status()['state'] == 'play' and self.current_playlistname == playlistname):
+                tracing.mark("lock acquired")
+                # the watcher's state snapshot tells whether this playlist is playing already - no need to ask MPD
+                if not (self.state.status['state'] == 'play' and self.current_playlistname == playlistname):
                     self.current_playlistname = playlistname
-                    self.mpd_client.clear()
-                    self.mpd_client.load(playlistname)
-
-                    # start playing from the beginning
-                    self.mpd_client.play()
-
-                    self.em_scene.new_card(playlistname)
-                logger.debug("Status: %s" % self.mpd_client.status())
-                logger.debug("currentsong: %s" % self.mpd_client.currentsong())
-        except ConnectionError as e:
-            if retry < 3:
-                logger.debug("play: connection Error - " + e.args[0] + " - retry")
-                self.connect_mpd()
-                self.play(playlistname, retry + 1)
-            else:
-                logger.error("player.play(): cannot connect to MPD after 3 retries")
-                # except Exception as e:
-                #   logger.error("Could not play playlist: "+playlistname+"Error: %s" % e.args[0])
-
-    def pause(self):
-        """
-        Toggle Play Pause of MPD
-
+                    # replace the playlist and start playing from the beginning, in a single round-trip
+                    self.send_command_list('clear', ('load', playlistname), 'play')
+                    tracing.mark("play acknowledged")
+                    started = True
+                else:
+                    tracing.end("already playing")
+            if started:
+                self.em_scene.new_card(playlistname)  # loads the cover - do not hold the MPD lock meanwhile
+        except CommandError as e:
+            # e.g. no playlist for this card - the connection is fine
+            logger.error("player.play(): could not play %s: %s" % (playlistname, e))
+            self.current_playlistname = 'init'
+            tracing.end("play failed")
+        except (ConnectionError, IOError) as e:
+            logger.error("player.play(): lost connection to MPD (%s) - playing %s once it answers again" % (e, playlistname))
+            self.current_playlistname = 'init'
+            self.pending_playlist = playlistname
+            self.connection.connection_lost()
+
+    def pause(self, paused=None):
+        """
+        Pause or resume MPD
+
+        :param paused: 1 to pause, 0 to resume, None to toggle
         :return:
         """
         with self.mpd_client:
-            self.mpd_client.pause()
+            if paused is None:
+                self.mpd_client.pause()
+            else:
+                self.mpd_client.pause(paused)
 
     def get_status(self):
         """
@@ -206,11 +743,9 @@ class Player(object):
 
         :return:
         """
-        with self.mpd_client:
-            if self.mpd_client.status()['playlistlength'] > 1:
-                self.mpd_client.next()
-                logger.debug("Status: %s" % self.mpd_client.status())
-                logger.debug("currentsong: %s" % self.mpd_client.currentsong())
+        if int(self.state.status.get('playlistlength', 0)) > 1:
+            with self.mpd_client:
+                self.send_command_list('next')
 
     def prev(self):
         """
@@ -218,11 +753,9 @@ class Player(object):
 
         :return:
         """
-        with self.mpd_client:
-            if self.mpd_client.status()['playlistlength'] > 1:
-                self.mpd_client.previous()
-                logger.debug("Status: %s" % self.mpd_client.status())
-                logger.debug("currentsong: %s" % self.mpd_client.currentsong())
+        if int(self.state.status.get('playlistlength', 0)) > 1:
+            with self.mpd_client:
+                self.send_command_list('previous')
 
 
     def close(self):
@@ -232,13 +765,21 @@ class Player(object):
         :return:
         """
         logger.debug("player.close()")
-        logger.debug("calling self.stop()")
-        self.stop()
-        time.sleep(0.5)
-        logger.debug("trying to get lock (with self.mpd_client:)")
-        with self.mpd_client:
-            logger.debug("calling  self.mpd_client.close()")
-            self.mpd_client.close()
+        self.watcher_terminated = True
+        self.commands.shutdown()
+        self.connection.close()
+        if not self.connected:
+            return
+        try:
+            logger.debug("calling self.stop()")
+            self.stop()
             time.sleep(0.5)
-            logger.debug("calling  self.mpd_client.disconnect()")
-            self.mpd_client.disconnect()
+            logger.debug("trying to get lock (with self.mpd_client:)")
+            with self.mpd_client:
+                logger.debug("calling  self.mpd_client.close()")
+                self.mpd_client.close()
+                time.sleep(0.5)
+                logger.debug("calling  self.mpd_client.disconnect()")
+                self.mpd_client.disconnect()
+        except (ConnectionError, IOError) as e:
+            logger.error("closing MPD connection failed: %s" % e)
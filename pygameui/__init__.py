@@ -36,9 +36,13 @@ LICENSE = 'MIT'
 __version__ = '0.2.0'
 
 
+import time
+import Queue
+
 import pygame
 
 from alert import *
+from artstore import *
 from button import *
 from callback import *
 from checkbox import *
@@ -49,6 +53,7 @@ from imagebutton import *
 from imageview import *
 from label import *
 from listview import *
+from marquee import *
 from notification import *
 from progress import *
 from render import *
@@ -61,6 +66,7 @@ from textfield import *
 from view import *
 
 import focus
+import profiler
 import window
 import scene
 import theme
@@ -76,6 +82,18 @@ Rect = pygame.Rect
 window_surface = None
 runui = True
 
+# number of pixels sent to the display by the last frame
+pixels_pushed = 0
+
+# frame rate while something is animating
+FPS = 60
+
+# longest time (seconds) the loop sleeps when nothing asks for an update
+IDLE_INTERVAL = 5.0
+
+# posted by `wakeup` (and used as timer event on pygame < 2)
+WAKEUP_EVENT = pygame.USEREVENT
+
 
 def init(name='', window_size=(640, 480)):
     logger.debug('init %s %s' % (__name__, __version__))
@@ -89,70 +107,193 @@ def init(name='', window_size=(640, 480)):
     theme.init()
 
 
+def wakeup():
+    """Wake the main loop up from idle; safe to call from any thread."""
+    pygame.event.post(pygame.event.Event(WAKEUP_EVENT))
+
+
+# functions queued by `call_soon`, run by the main loop before each frame
+_commands = Queue.Queue()
+
+
+def call_soon(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the main loop before the next frame.
+
+    Views and scenes must only be changed from the main loop; other
+    threads pass their changes through this. Safe to call from any
+    thread.
+    """
+    _commands.put((fn, args, kwargs))
+    wakeup()
+
+
+def _run_commands():
+    """Run the functions queued so far (not those queued meanwhile)."""
+    for i in range(_commands.qsize()):
+        try:
+            fn, args, kwargs = _commands.get_nowait()
+        except Queue.Empty:
+            break
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception('queued call of %r failed' % fn)
+
+
+def _wait_events(timeout):
+    """Block until an event arrives or `timeout` seconds have passed.
+
+    Returns the list of pending events, which is empty on timeout.
+    """
+    ms = max(1, int(timeout * 1000))
+    if pygame.version.vernum[0] >= 2:
+        e = pygame.event.wait(ms)
+    else:
+        # no timeout for event.wait on pygame 1.x; use a one shot timer
+        pygame.time.set_timer(WAKEUP_EVENT, ms)
+        e = pygame.event.wait()
+        pygame.time.set_timer(WAKEUP_EVENT, 0)
+    events = pygame.event.get()
+    if e.type != pygame.NOEVENT:
+        events.insert(0, e)
+    return events
+
+
+# view that got the last mouse button down event (receives drags)
+_down_in_view = None
+
+
+def dispatch_event(e):
+    """Send an input event to the view(s) of the current scene."""
+    global _down_in_view
+
+    if e.type == pygame.QUIT:
+        pygame.quit()
+        import sys
+        sys.exit()
+
+    mousepoint = pygame.mouse.get_pos()
+    invalidate_transforms()   # views may have moved since the last event
+
+    if e.type == pygame.MOUSEBUTTONDOWN:
+        hit_view = scene.current.hit(mousepoint)
+        logger.debug('hit %s' % hit_view)
+        if (hit_view is not None and
+            not isinstance(hit_view, scene.Scene)):
+            focus.set(hit_view)
+            _down_in_view = hit_view
+            pt = hit_view.from_window(mousepoint)
+            hit_view.mouse_down(e.button, pt)
+        else:
+            focus.set(None)
+    elif e.type == pygame.MOUSEBUTTONUP:
+        hit_view = scene.current.hit(mousepoint)
+        if hit_view is not None:
+            if _down_in_view and hit_view != _down_in_view:
+                _down_in_view.blurred()
+                focus.set(None)
+            pt = hit_view.from_window(mousepoint)
+            hit_view.mouse_up(e.button, pt)
+        _down_in_view = None
+    elif e.type == pygame.MOUSEMOTION:
+        if _down_in_view and _down_in_view.draggable:
+            pt = _down_in_view.from_window(mousepoint)
+            _down_in_view.mouse_drag(pt, e.rel)
+        else:
+            scene.current.mouse_motion(mousepoint)
+    elif e.type == pygame.KEYDOWN:
+        if focus.view:
+            focus.view.key_down(e.key, e.unicode)
+        else:
+            scene.current.key_down(e.key, e.unicode)
+    elif e.type == pygame.KEYUP:
+        if focus.view:
+            focus.view.key_up(e.key)
+        else:
+            scene.current.key_up(e.key)
+
+
+def draw_frame():
+    """Redraw the damaged areas of the current scene and show them.
+
+    Returns the number of pixels sent to the display (also kept in
+    `pixels_pushed`).
+    """
+    global pixels_pushed
+
+    pixels_pushed = 0
+    rects = scene.current.take_damage()
+    if rects:
+        for rect in rects:
+            scene.current.surface.set_clip(rect)
+            scene.current.draw()
+            window_surface.blit(scene.current.surface, rect, rect)
+            pixels_pushed += rect.w * rect.h
+        scene.current.presented()
+    if profiler.overlay and (rects or profiler.overlay_stale()):
+        rect = profiler.draw_overlay(window_surface)
+        rects.append(rect)
+        pixels_pushed += rect.w * rect.h
+    if rects:
+        pygame.display.update(rects)
+    return pixels_pushed
+
+
 def run():
+    """Run the main loop until `runui` is cleared.
+
+    The loop runs at `FPS` only while a view of the current scene is
+    animating (see `View.update_interval`). Otherwise it blocks until
+    the next input event, `wakeup` call or view timer, but at most for
+    `IDLE_INTERVAL` seconds. Functions queued by `call_soon` run once
+    per frame, after the events were dispatched. While `profiler` is
+    enabled, it is told about each frame.
+    """
     assert len(scene.stack) > 0
 
     clock = pygame.time.Clock()
-    down_in_view = None
 
     elapsed = 0
-    
-    global runui
+    frames = 0
+    pixels = 0
 
     while runui:
-        dt = clock.tick(60)
+        interval = scene.current.update_interval()
+        if interval is None or interval > IDLE_INTERVAL:
+            interval = IDLE_INTERVAL
+        if scene.current.damaged_rects or not _commands.empty():
+            interval = 0
+        if profiler.overlay:
+            interval = min(interval, profiler.OVERLAY_INTERVAL)
+
+        if interval > 1.0 / FPS:
+            events = _wait_events(interval)
+            dt = clock.tick()
+        else:
+            dt = clock.tick(FPS)
+            events = pygame.event.get()
+        start = time.time()
 
         elapsed += dt
+        frames += 1
         if elapsed > 5000:
+            logger.debug('%d FPS, %d pixels/frame', clock.get_fps(),
+                         pixels // frames)
+            if profiler.enabled:
+                logger.debug(profiler.summary())
             elapsed = 0
-            logger.debug('%d FPS', clock.get_fps())
-
-        for e in pygame.event.get():
-            if e.type == pygame.QUIT:
-                pygame.quit()
-                import sys
-                sys.exit()
-
-            mousepoint = pygame.mouse.get_pos()
-
-            if e.type == pygame.MOUSEBUTTONDOWN:
-                hit_view = scene.current.hit(mousepoint)
-                logger.debug('hit %s' % hit_view)
-                if (hit_view is not None and
-                    not isinstance(hit_view, scene.Scene)):
-                    focus.set(hit_view)
-                    down_in_view = hit_view
-                    pt = hit_view.from_window(mousepoint)
-                    hit_view.mouse_down(e.button, pt)
-                else:
-                    focus.set(None)
-            elif e.type == pygame.MOUSEBUTTONUP:
-                hit_view = scene.current.hit(mousepoint)
-                if hit_view is not None:
-                    if down_in_view and hit_view != down_in_view:
-                        down_in_view.blurred()
-                        focus.set(None)
-                    pt = hit_view.from_window(mousepoint)
-                    hit_view.mouse_up(e.button, pt)
-                down_in_view = None
-            elif e.type == pygame.MOUSEMOTION:
-                if down_in_view and down_in_view.draggable:
-                    pt = down_in_view.from_window(mousepoint)
-                    down_in_view.mouse_drag(pt, e.rel)
-                else:
-                    scene.current.mouse_motion(mousepoint)
-            elif e.type == pygame.KEYDOWN:
-                if focus.view:
-                    focus.view.key_down(e.key, e.unicode)
-                else:
-                    scene.current.key_down(e.key, e.unicode)
-            elif e.type == pygame.KEYUP:
-                if focus.view:
-                    focus.view.key_up(e.key)
-                else:
-                    scene.current.key_up(e.key)
+            frames = 0
+            pixels = 0
+
+        for e in events:
+            dispatch_event(e)
+
+        _run_commands()
 
         scene.current.update(dt / 1000.0)
-        scene.current.draw()
-        window_surface.blit(scene.current.surface, (0, 0))
-        pygame.display.flip()
+
+        pixels += draw_frame()
+
+        profiler.poll()
+        if profiler.enabled:
+            profiler.frame_done(time.time() - start)
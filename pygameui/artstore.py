@@ -0,0 +1,245 @@
+"""A store of pre-scaled images in display pixel format ("compiled" art).
+
+Loading a PNG means decoding it, converting it to the display's pixel
+format and usually scaling it. For a fixed set of images (e.g. cover
+art) all of that can be done once, ahead of time: the store keeps each
+image of a source directory as a raw dump of a display format surface
+of the target size. Showing such an image costs a memory-mapped copy.
+
+    store = ArtStore('/home/pi/music/images/',
+                     '/home/pi/music/images/320x215/', (320, 215))
+    store.compile()                 # only new/changed images
+    img = store.load('1.2.3.4')     # None if not compiled (or stale)
+
+The store directory holds one '<name>.raw' file per image and an index
+(index.json) with the pixel format and, per image, the source file's
+mtime, size and SHA-1 hash. An image is only recompiled when its
+source's content changed.
+
+Run this module to compile a store offline, e.g. on the Pi:
+
+    python artstore.py /home/pi/music/images/ \\
+        /home/pi/music/images/320x215/ --size 320x215 --depth 16
+
+"""
+
+import os
+import json
+import mmap
+import glob
+import hashlib
+import logging
+
+import pygame
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+
+def _file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _surface_format(surface):
+    return dict(bitsize=surface.get_bitsize(),
+                bytesize=surface.get_bytesize(),
+                masks=list(surface.get_masks()),
+                pitch=surface.get_pitch())
+
+
+class ArtStore(object):
+    """Pre-scaled, display format versions of the PNGs in a directory.
+
+    src_dir
+
+        directory (with trailing slash) of the source '<name>.png'
+        images.
+
+    store_dir
+
+        directory the compiled images and the index are kept in.
+
+    size
+
+        (width, height) all images are scaled to.
+
+    """
+
+    def __init__(self, src_dir, store_dir, size):
+        self.src_dir = src_dir
+        self.store_dir = store_dir
+        self.size = tuple(size)
+        self.index = self._read_index()
+
+    def _index_path(self):
+        return os.path.join(self.store_dir, INDEX_NAME)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if (index.get('version') != INDEX_VERSION or
+            tuple(index.get('size', ())) != self.size):
+            return None
+        return index
+
+    def _write_index(self, index):
+        path = self._index_path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def _target_surface(self, depth=None):
+        display = pygame.display.get_surface()
+        if depth is None and display is not None:
+            return pygame.Surface(self.size, 0, display)
+        return pygame.Surface(self.size, 0, depth or 16)
+
+    def compile(self, depth=None, force=False):
+        """Compile new and changed source images; drop removed ones.
+
+        The pixel format is the current display's unless depth (bits
+        per pixel) is given or there is no display yet (then 16).
+        Changing the format recompiles everything.
+
+        Returns the number of images (re)compiled.
+        """
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+
+        target = self._target_surface(depth)
+        pixel_format = _surface_format(target)
+
+        index = self.index
+        if (force or index is None or
+            index.get('format') != pixel_format):
+            index = dict(version=INDEX_VERSION, size=list(self.size),
+                         format=pixel_format, images={})
+        images = index['images']
+
+        compiled = 0
+        names = set()
+        for src_path in sorted(glob.glob(os.path.join(self.src_dir,
+                                                      '*.png'))):
+            name = os.path.basename(src_path)[:-len('.png')]
+            names.add(name)
+            st = os.stat(src_path)
+            entry = images.get(name)
+            if (entry is not None and entry['mtime'] == st.st_mtime and
+                entry['bytes'] == st.st_size):
+                continue
+            digest = _file_hash(src_path)
+            if entry is not None and entry['sha1'] == digest:
+                entry['mtime'] = st.st_mtime    # touched, not changed
+                continue
+            try:
+                self._compile_image(src_path, name, target)
+            except (pygame.error, IOError), e:
+                logger.warn('failed to compile %s: %s' % (src_path, e))
+                images.pop(name, None)
+                continue
+            images[name] = dict(mtime=st.st_mtime, bytes=st.st_size,
+                                sha1=digest)
+            compiled += 1
+
+        for name in set(images) - names:
+            del images[name]
+            try:
+                os.remove(self._raw_path(name))
+            except OSError:
+                pass
+
+        self._write_index(index)
+        self.index = index
+        logger.debug('compiled %d of %d images into %s' %
+                     (compiled, len(images), self.store_dir))
+        return compiled
+
+    def _raw_path(self, name):
+        return os.path.join(self.store_dir, name + '.raw')
+
+    def _compile_image(self, src_path, name, target):
+        img = pygame.image.load(src_path)
+        if img.get_bitsize() < 24:   # smoothscale needs 24/32 bit
+            rgb = pygame.Surface(img.get_size(), 0, 32)
+            rgb.blit(img, (0, 0))
+            img = rgb
+        if img.get_size() != self.size:
+            img = pygame.transform.smoothscale(img, self.size)
+        target.fill((0, 0, 0))
+        target.blit(img, (0, 0))
+        path = self._raw_path(name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(target.get_buffer().raw)
+        os.rename(path + '.tmp', path)
+
+    def load(self, name):
+        """The compiled image `name` as a new display format surface.
+
+        Returns None if the image is not compiled, its source changed
+        since or the store does not match the display's pixel format.
+        """
+        if self.index is None:
+            return None
+        entry = self.index['images'].get(name)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(os.path.join(self.src_dir, name + '.png'))
+        except OSError:
+            return None
+        if entry['mtime'] != st.st_mtime or entry['bytes'] != st.st_size:
+            return None
+
+        display = pygame.display.get_surface()
+        if display is None:
+            return None
+        surface = pygame.Surface(self.size, 0, display)
+        if _surface_format(surface) != self.index['format']:
+            logger.debug('art store %s does not match display format' %
+                         self.store_dir)
+            return None
+
+        try:
+            with open(self._raw_path(name), 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    surface.get_buffer().write(data, 0)
+                finally:
+                    data.close()
+        except (IOError, ValueError, EnvironmentError), e:
+            logger.warn('failed to load compiled image %s: %s' % (name, e))
+            return None
+        return surface
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Compile PNG images into a store of pre-scaled, '
+                    'display format images.')
+    parser.add_argument('src_dir')
+    parser.add_argument('store_dir')
+    parser.add_argument('--size', default='320x215',
+                        help='target size WxH (default: 320x215)')
+    parser.add_argument('--depth', type=int, default=16,
+                        help='bits per pixel of the display (default: 16)')
+    parser.add_argument('--force', action='store_true',
+                        help='recompile all images')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    w, h = [int(v) for v in args.size.split('x')]
+    store = ArtStore(os.path.join(args.src_dir, ''), args.store_dir, (w, h))
+    print('%d images compiled' % store.compile(args.depth, args.force))
@@ -42,6 +42,10 @@ class FlipbookView(view.View):
         if self.elapsed > self.delay:
             self.current_frame = (self.current_frame + 1) % self.frame_count
             self.elapsed = 0
+            self.set_needs_display()
+
+    def update_interval(self):
+        return max(0, self.delay - self.elapsed)
 
     def draw(self):
         if not view.View.draw(self):
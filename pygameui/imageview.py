@@ -54,6 +54,7 @@ class ImageView(view.View):
     @image.setter
     def image(self, new_image):
         self._image = new_image
+        self.set_needs_display()
 
     def layout(self):
         assert self.padding[0] == 0 and self.padding[1] == 0
@@ -63,6 +64,9 @@ class ImageView(view.View):
             assert False, "Unknown content_mode"
         view.View.layout(self)
 
+    def create_surface(self, size):
+        return self._image   # shown as is, see draw
+
     def draw(self):
         self.surface = self._image
 
@@ -37,6 +37,10 @@ An example walk:
     # 'a'          b.a
     # 'x'          b.a.x
     # 'y[1]'       b.a.x.y[1]
+
+Key paths are parsed once into a KeyPath (see compile_keypath) which is
+cached, so walking a path again does no string splitting or regex
+matching.
 """
 
 AUTHOR = 'Brian Hammond <brian@fictorial.com>'
@@ -55,50 +59,90 @@ def _extract(val, key):
     return getattr(val, key, None)
 
 
+class KeyPath(object):
+    """A key path parsed into (identifier, index or None) parts."""
+
+    __slots__ = ('path', 'parts', '_init', '_last')
+
+    def __init__(self, path):
+        self.path = path
+        self.parts = []
+        for part in path.split('.'):
+            match = re.match(list_index_re, part)
+            if match is not None:
+                self.parts.append((match.group(1), int(match.group(2))))
+            else:
+                self.parts.append((part, None))
+        self._init = self.parts[:-1]
+        self._last = self.parts[-1]
+
+    def value(self, obj):
+        """Get value from walking this key path with start object obj.
+        """
+        val = obj
+        for key, index in self.parts:
+            val = _extract(val, key)
+            if index is not None:
+                if not isinstance(val, list) and not isinstance(val, tuple):
+                    raise TypeError('expected list/tuple')
+                val = val[index]
+            if val is None:
+                return None
+        return val
+
+    def set_value(self, obj, new_value):
+        """Set new_value at this key path of start object obj.
+        """
+        dst = obj
+        for key, index in self._init:
+            dst = _extract(dst, key)
+            if index is not None:
+                if not isinstance(dst, list) and not isinstance(dst, tuple):
+                    raise TypeError('expected list/tuple')
+                dst = dst[index]
+        key, index = self._last
+        if index is not None:
+            dst = _extract(dst, key)
+            if not isinstance(dst, list) and not isinstance(dst, tuple):
+                raise TypeError('expected list/tuple')
+            dst[index] = new_value
+        elif isinstance(dst, dict):
+            dst[key] = new_value
+        else:
+            setattr(dst, key, new_value)
+
+    def __repr__(self):
+        return 'KeyPath(%r)' % self.path
+
+
+_keypaths = {}
+
+
+def compile_keypath(path):
+    """The (cached) KeyPath for path."""
+    try:
+        return _keypaths[path]
+    except KeyError:
+        keypath = _keypaths[path] = KeyPath(path)
+        return keypath
+
+
 def value_for_keypath(obj, path):
     """Get value from walking key path with start object obj.
     """
-    val = obj
-    for part in path.split('.'):
-        match = re.match(list_index_re, part)
-        if match is not None:
-            val = _extract(val, match.group(1))
-            if not isinstance(val, list) and not isinstance(val, tuple):
-                raise TypeError('expected list/tuple')
-            index = int(match.group(2))
-            val = val[index]
-        else:
-            val = _extract(val, part)
-        if val is None:
-            return None
-    return val
+    return compile_keypath(path).value(obj)
 
 
 def set_value_for_keypath(obj, path, new_value):
     """Set attribute value new_value at key path of start object obj.
     """
-    parts = path.split('.')
-    last_part = len(parts) - 1
-    dst = obj
-    for i, part in enumerate(parts):
-        match = re.match(list_index_re, part)
-        if match is not None:
-            dst = _extract(dst, match.group(1))
-            if not isinstance(dst, list) and not isinstance(dst, tuple):
-                raise TypeError('expected list/tuple')
-            index = int(match.group(2))
-            if i == last_part:
-                dst[index] = new_value
-            else:
-                dst = dst[index]
+    if '.' not in path and '[' not in path:     # plain attribute / key
+        if isinstance(obj, dict):
+            obj[path] = new_value
         else:
-            if i != last_part:
-                dst = _extract(dst, part)
-            else:
-                if isinstance(dst, dict):
-                    dst[part] = new_value
-                else:
-                    setattr(dst, part, new_value)
+            setattr(obj, path, new_value)
+        return
+    compile_keypath(path).set_value(obj, new_value)
 
 
 if __name__ == '__main__':
@@ -115,3 +159,8 @@ if __name__ == '__main__':
 
     set_value_for_keypath(b, 'a.x.y[1]', 2)
     assert value_for_keypath(b, 'a.x.y[1]') == 2
+
+    set_value_for_keypath(b, 'a.x', {})
+    set_value_for_keypath(b, 'a.x.z', 3)
+    assert value_for_keypath(b, 'a.x.z') == 3
+    assert compile_keypath('a.x.z') is compile_keypath('a.x.z')
@@ -1,6 +1,7 @@
 import re
 
 import view
+import resource
 
 
 CENTER = 0
@@ -13,6 +14,21 @@ WORD_WRAP = 0
 CLIP = 1
 
 
+# rendered text surfaces shared by all labels, keyed by (text, font, color)
+TEXT_CACHE_BYTES = 512 * 1024
+text_cache = resource.ImageCache(TEXT_CACHE_BYTES)
+
+
+def render_text(font, text, color):
+    """font.render(text, True, color) via text_cache."""
+    key = (text, font, color)
+    surface = text_cache.get(key)
+    if surface is None:
+        surface = font.render(text, True, color)
+        text_cache.put(key, surface)
+    return surface
+
+
 class Label(view.View):
     """Multi-line, word-wrappable, uneditable text view.
 
@@ -90,6 +106,7 @@ class Label(view.View):
         self._wrap_mode = wrap
         self._text = text
         self._enabled = False
+        self._render_key = None
 
     @property
     def text(self):
@@ -114,9 +131,20 @@ class Label(view.View):
         view.View.layout(self)
 
     def render(self):
-        """Force (re)draw the text to cached surfaces.
+        """(Re)draw the text to cached surfaces.
+
+        Nothing is done if neither the text nor any of the style
+        attributes or the frame width used to render it changed since
+        the last call.
         """
+        key = (self._text, self.font, self.text_color,
+               self.text_shadow_color, self.text_shadow_offset,
+               self._wrap_mode, self.frame.w, tuple(self.padding))
+        if key == self._render_key:
+            return
         self._render(self._text)
+        self._render_key = key
+        self.set_needs_display()
 
     def _render(self, text):
         self.text_surfaces, self.text_shadow_surfaces = [], []
@@ -138,11 +166,11 @@ class Label(view.View):
 
     def _render_line(self, line_text, wants_shadows):
         line_text = line_text.strip()
-        text_surface = self.font.render(line_text, True, self.text_color)
+        text_surface = render_text(self.font, line_text, self.text_color)
         self.text_surfaces.append(text_surface)
         if wants_shadows:
-            text_shadow_surface = self.font.render(
-                line_text, True, self.text_shadow_color)
+            text_shadow_surface = render_text(
+                self.font, line_text, self.text_shadow_color)
             self.text_shadow_surfaces.append(text_shadow_surface)
         return text_surface.get_size()
 
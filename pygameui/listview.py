@@ -22,6 +22,7 @@ class ListView(view.View):
         """items: list of views"""
         frame.size = self._find_size_to_contain(items)
         view.View.__init__(self, frame)
+        self.spatial_index = True
         self.items = items
         self.selected_index = None
         self.on_selected = callback.Signal()
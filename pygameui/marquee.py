@@ -0,0 +1,116 @@
+import pygame
+
+import view
+import label
+
+
+class MarqueeLabel(label.Label):
+    """A single line label that scrolls text too long for its frame.
+
+    The text (and its shadow) is rendered once into an off-screen strip
+    holding it twice; scrolling just moves the part of the strip that
+    is blitted. Text that fits is shown like in a Label and does not
+    animate at all.
+
+    scroll_rate
+
+        Scroll speed in pixels per second; default: 30.
+
+    scroll_delay
+
+        Seconds the start of the text stays in place before each
+        pass; default: 2.
+
+    gap
+
+        Pixels between the end of the text and its next pass;
+        default: 40.
+
+    """
+
+    def __init__(self, frame, text, halign=label.CENTER,
+                 valign=label.CENTER):
+        label.Label.__init__(self, frame, text, halign, valign,
+                             wrap=label.CLIP)
+        self.scroll_rate = 30
+        self.scroll_delay = 2
+        self.gap = 40
+        self._strip = None
+        self._offset = 0.0
+        self._wait = 0
+
+    def render(self):
+        key = self._render_key
+        label.Label.render(self)
+        if self._render_key != key:
+            self._render_strip()
+
+    def _render_strip(self):
+        self._strip = None
+        self._offset = 0.0
+        self._wait = self.scroll_delay
+
+        if not self.text_surfaces:
+            return
+        text_surface = self.text_surfaces[0]
+        w, h = text_surface.get_size()
+        if w <= self.frame.w - self.padding[0] * 2:
+            return
+
+        dx, dy = 0, 0
+        if self.text_shadow_surfaces:
+            dx, dy = self.text_shadow_offset
+        strip = pygame.Surface((w * 2 + self.gap + abs(dx), h + abs(dy)),
+                               pygame.SRCALPHA, 32)
+        for x in (0, w + self.gap):
+            if self.text_shadow_surfaces:
+                strip.blit(self.text_shadow_surfaces[0],
+                           (x + max(dx, 0), max(dy, 0)))
+            strip.blit(text_surface, (x + max(-dx, 0), max(-dy, 0)))
+        self._strip = strip
+        self._strip_top = -max(-dy, 0)
+        self._period = w + self.gap
+
+    @property
+    def scrolling(self):
+        return self._strip is not None
+
+    def update(self, dt):
+        label.Label.update(self, dt)
+        if self._strip is None:
+            return
+        if self._wait > 0:
+            self._wait -= dt
+            return
+        offset = self._offset + dt * self.scroll_rate
+        if offset >= self._period:
+            offset = 0.0
+            self._wait = self.scroll_delay
+        if int(offset) != int(self._offset):
+            self.set_needs_display()
+        self._offset = offset
+
+    def update_interval(self):
+        interval = label.Label.update_interval(self)
+        if self._strip is not None:
+            if self._wait > 0:
+                wait = self._wait
+            else:
+                wait = (1 - self._offset % 1) / float(self.scroll_rate)
+            if interval is None or wait < interval:
+                interval = wait
+        return interval
+
+    def draw(self):
+        if self._strip is None:
+            return label.Label.draw(self)
+
+        if not view.View.draw(self):
+            return False
+
+        visible_w = self.frame.w - self.padding[0] * 2
+        area = pygame.Rect(int(self._offset), 0,
+                           visible_w, self._strip.get_height())
+        top_left = (self.padding[0], self._determine_top() + self._strip_top)
+        self.surface.blit(self._strip, top_left, area)
+        return True
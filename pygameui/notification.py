@@ -9,6 +9,10 @@ DOWN = 0
 UP = 1
 IDLE = 2
 
+# longest animation step (seconds); the first frame after the main loop
+# was idle can have a very large dt
+MAX_STEP = 0.05
+
 
 class NotificationView(dialog.DialogView):
     """A notification alert view.
@@ -62,15 +66,16 @@ class NotificationView(dialog.DialogView):
     def update(self, dt):
         dialog.DialogView.update(self, dt)
         rate = 300
+        step = min(dt, MAX_STEP)
         if self.animation_state == DOWN:
             if self.frame.top < 0:
-                self.frame.top += dt * rate
+                self.frame.top += step * rate
                 self.frame.top = min(self.frame.top, 0)
             else:
                 self.animation_state = IDLE
         elif self.animation_state == UP:
             if self.frame.top > -self.frame.h:
-                self.frame.top -= dt * rate
+                self.frame.top -= step * rate
             else:
                 self.rm()
         elif self.animation_state == IDLE:
@@ -78,6 +83,13 @@ class NotificationView(dialog.DialogView):
             if self.elapsed > self.auto_close_after:
                 self.animation_state = UP
 
+    def update_interval(self):
+        if self.animation_state != IDLE:
+            return 0
+        if not self.auto_close:
+            return None
+        return max(0, self.auto_close_after - self.elapsed)
+
 
 def show_notification(message):
     notification = NotificationView(message)
@@ -0,0 +1,334 @@
+"""Opt-in profiling of the views' update, layout, draw and stylize.
+
+While enabled, these methods of every View class are wrapped to measure
+how often they run and how long they take, per class and per view
+instance. Times are exclusive: a view's draw does not include the draw
+of its children. Besides the totals, a rolling average of the time per
+frame is kept (decaying by `DECAY` per frame).
+
+    ui.profiler.enable(show_overlay=True)   # FPS and the top offenders
+    ...
+    ui.profiler.dump('/tmp/profile.json')
+
+`install_signal_handler` lets a signal toggle profiling on a running app
+(dumping the stats when it is turned off). Disabled, nothing is wrapped
+and profiling costs nothing.
+"""
+
+import json
+import time
+import signal
+import weakref
+
+import pygame
+
+import view
+import resource
+import scene
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+METHODS = ('update', 'layout', 'draw', 'stylize')
+
+# weight of the last frame in the rolling averages
+DECAY = 0.05
+
+# seconds between refreshes of the overlay
+OVERLAY_INTERVAL = 0.5
+
+# number of offenders listed by the overlay and `summary`
+TOP = 3
+
+enabled = False
+overlay = False
+
+# set by the signal handler, applied by the main loop (see `poll`)
+toggle_requested = False
+dump_path = None
+
+frames = 0
+fps = 0.0
+frame_ms = 0.0
+
+# (class name, method) -> Stat
+classes = {}
+
+# view -> {method: Stat}
+instances = weakref.WeakKeyDictionary()
+
+_originals = []     # (class, method name, function) replaced by `enable`
+_stack = []         # [view, method, start, seconds in nested calls]
+_last_frame = None
+
+_overlay_surface = None
+_overlay_rect = None
+_overlay_time = 0
+
+
+class Stat(object):
+    """Calls and time of one method of a class or view.
+
+        calls   number of calls
+        time    total seconds
+        max     longest call (seconds)
+        avg     rolling average of the seconds per frame
+
+    """
+
+    __slots__ = ('calls', 'time', 'max', 'avg', 'frame', 'frame_no')
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.max = 0.0
+        self.avg = 0.0
+        self.frame = 0.0
+        self.frame_no = frames
+
+    def add(self, seconds):
+        self.fold()
+        self.calls += 1
+        self.time += seconds
+        self.frame += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def fold(self):
+        """Fold the frames completed since the last call into `avg`."""
+        if self.frame_no == frames:
+            return
+        self.avg += (self.frame - self.avg) * DECAY
+        skipped = frames - self.frame_no - 1
+        if skipped > 0:
+            self.avg *= (1 - DECAY) ** skipped
+        self.frame = 0.0
+        self.frame_no = frames
+
+    def as_dict(self):
+        self.fold()
+        return dict(calls=self.calls, ms=round(self.time * 1000, 3),
+                    max_ms=round(self.max * 1000, 3),
+                    avg_ms=round(self.avg * 1000, 3))
+
+
+def _record(v, method, seconds):
+    key = (type(v).__name__, method)
+    stat = classes.get(key)
+    if stat is None:
+        stat = classes[key] = Stat()
+    stat.add(seconds)
+
+    try:
+        methods = instances[v]
+    except KeyError:
+        methods = instances[v] = {}
+    stat = methods.get(method)
+    if stat is None:
+        stat = methods[method] = Stat()
+    stat.add(seconds)
+
+
+def _wrap(method, function):
+    def profiled(self, *args, **kwargs):
+        if _stack and _stack[-1][0] is self and _stack[-1][1] == method:
+            return function(self, *args, **kwargs)   # super class method
+        entry = [self, method, time.time(), 0.0]
+        _stack.append(entry)
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            _stack.pop()
+            elapsed = time.time() - entry[2]
+            if _stack:
+                _stack[-1][3] += elapsed
+            _record(self, method, elapsed - entry[3])
+
+    profiled.__name__ = function.__name__
+    profiled.__doc__ = function.__doc__
+    return profiled
+
+
+def _view_classes():
+    found = [view.View]
+    for cls in found:
+        for sub in cls.__subclasses__():
+            if sub not in found:
+                found.append(sub)
+    return found
+
+
+def enable(show_overlay=False):
+    """Start profiling the View classes defined so far."""
+    global enabled, _last_frame
+
+    if not enabled:
+        for cls in _view_classes():
+            for method in METHODS:
+                function = cls.__dict__.get(method)
+                if function is not None:
+                    _originals.append((cls, method, function))
+                    setattr(cls, method, _wrap(method, function))
+        enabled = True
+        _last_frame = None
+        logger.info('profiling views')
+    set_overlay(show_overlay)
+
+
+def disable():
+    """Stop profiling; the stats collected so far are kept."""
+    global enabled
+
+    set_overlay(False)
+    if not enabled:
+        return
+    while _originals:
+        cls, method, function = _originals.pop()
+        setattr(cls, method, function)
+    del _stack[:]
+    enabled = False
+    logger.info('stopped profiling views')
+
+
+def reset():
+    """Forget the stats collected so far."""
+    global frames, fps, frame_ms, _last_frame
+
+    classes.clear()
+    instances.clear()
+    frames = 0
+    fps = 0.0
+    frame_ms = 0.0
+    _last_frame = None
+
+
+def toggle():
+    """Enable profiling with the overlay, or dump (to `dump_path`, if
+    set) and disable it."""
+    if enabled:
+        if dump_path is not None:
+            dump(dump_path)
+        disable()
+    else:
+        enable(show_overlay=True)
+
+
+def set_overlay(show):
+    global overlay, _overlay_surface
+
+    if overlay and not show and _overlay_rect is not None:
+        scene.current.add_damage(_overlay_rect)   # restore what it covered
+    overlay = show and enabled
+    _overlay_surface = None
+
+
+def install_signal_handler(path, signum=signal.SIGUSR2):
+    """Toggle profiling on signal `signum`, dumping the stats to `path`
+    each time it is turned off."""
+    global dump_path
+
+    dump_path = path
+
+    def handler(signum, frame):
+        # only flag the request: the handler may interrupt a profiled
+        # method, so the main loop applies it between frames
+        global toggle_requested
+        toggle_requested = True
+        pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+
+    signal.signal(signum, handler)
+
+
+def poll():
+    """Apply a toggle requested by the signal handler."""
+    global toggle_requested
+
+    if toggle_requested:
+        toggle_requested = False
+        toggle()
+
+
+def frame_done(seconds):
+    """Account a frame of the main loop that took `seconds` of work."""
+    global frames, fps, frame_ms, _last_frame
+
+    now = time.time()
+    if _last_frame is not None and now > _last_frame:
+        fps += (1.0 / (now - _last_frame) - fps) * DECAY
+    _last_frame = now
+    frame_ms += (seconds * 1000 - frame_ms) * DECAY
+    frames += 1
+
+
+def top(n=TOP):
+    """Return the n (class name, method, Stat) with the highest rolling
+    average time per frame."""
+    for stat in classes.values():
+        stat.fold()
+    rows = sorted(classes.items(), key=lambda kv: -kv[1].avg)[:n]
+    return [(cls, method, stat) for (cls, method), stat in rows]
+
+
+def summary(n=TOP):
+    parts = ['%s.%s %.2fms' % (cls, method, stat.avg * 1000)
+             for cls, method, stat in top(n)]
+    return '%.1f FPS, %.2fms/frame: %s' % (fps, frame_ms, ', '.join(parts))
+
+
+def dump(path):
+    """Write the stats collected so far as JSON to path."""
+    views = []
+    for v, methods in instances.items():
+        name = '%s@%x' % (type(v).__name__, id(v))
+        for method, stat in methods.items():
+            row = stat.as_dict()
+            row.update(view=name, method=method)
+            views.append(row)
+    views.sort(key=lambda row: -row['ms'])
+
+    rows = []
+    for (cls, method), stat in classes.items():
+        row = stat.as_dict()
+        row.update(cls=cls, method=method)
+        rows.append(row)
+    rows.sort(key=lambda row: -row['ms'])
+
+    with open(path, 'w') as f:
+        json.dump(dict(time=time.time(), frames=frames,
+                       fps=round(fps, 2), frame_ms=round(frame_ms, 3),
+                       classes=rows, views=views), f, indent=1)
+    logger.info('profile written to %s' % path)
+
+
+def overlay_stale():
+    return _overlay_surface is None or \
+        time.time() - _overlay_time >= OVERLAY_INTERVAL
+
+
+def draw_overlay(surface):
+    """Draw the overlay in the top left corner of surface and return the
+    rect it covers."""
+    global _overlay_surface, _overlay_rect, _overlay_time
+
+    if overlay_stale():
+        lines = ['%.1f FPS %.2fms' % (fps, frame_ms)]
+        lines += ['%s.%s %.2fms' % (cls, method, stat.avg * 1000)
+                  for cls, method, stat in top()]
+        font = resource.get_font(10)
+        texts = [font.render(line, True, (255, 255, 0)) for line in lines]
+        width = max(text.get_width() for text in texts) + 4
+        height = sum(text.get_height() for text in texts) + 4
+        if _overlay_rect is not None and \
+                (width < _overlay_rect.w or height < _overlay_rect.h):
+            scene.current.add_damage(_overlay_rect)   # it shrinks
+        _overlay_surface = pygame.Surface((width, height))
+        y = 2
+        for text in texts:
+            _overlay_surface.blit(text, (2, y))
+            y += text.get_height()
+        _overlay_rect = _overlay_surface.get_rect()
+        _overlay_time = time.time()
+    surface.blit(_overlay_surface, _overlay_rect)
+    return _overlay_rect
@@ -2,13 +2,52 @@ import slider
 
 
 class ProgressView(slider.SliderView):
-    """A progress bar."""
+    """A progress bar.
+
+    clock
+
+        Optional object the bar follows by itself; must provide
+        `progress()` (the current progress) and `time_until(progress)`
+        (seconds until the given progress is reached or None if it
+        won't be reached). The bar is only changed, and thus redrawn,
+        when its filled width changes by a pixel.
+
+    min_refresh_interval
+
+        Shortest time (seconds) between two updates from the clock;
+        default: 0.25.
+
+    """
 
     def __init__(self, frame):
         slider.SliderView.__init__(self, frame, slider.HORIZONTAL,
                                    0.0, 1.0, show_thumb=False)
         self.enabled = False
         self.progress = 0
+        self.clock = None
+        self.min_refresh_interval = 0.25
+
+    def _pixels(self, progress):
+        return int(progress * self.track.frame.w)
+
+    def update(self, dt):
+        slider.SliderView.update(self, dt)
+        if self.clock is not None:
+            progress = min(1.0, max(0.0, self.clock.progress()))
+            if self._pixels(progress) != self._pixels(self._value):
+                self.progress = progress
+
+    def update_interval(self):
+        interval = slider.SliderView.update_interval(self)
+        if self.clock is not None:
+            pixels = self._pixels(self._value)
+            wait = self.clock.time_until(
+                (pixels + 1) / float(self.track.frame.w))
+            if wait is not None:
+                wait = max(wait, self.min_refresh_interval)
+                if interval is None or wait < interval:
+                    interval = wait
+        return interval
 
     @property
     def progress(self):
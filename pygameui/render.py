@@ -1,5 +1,38 @@
 import pygame
 
+import resource
+
+
+# gradients are rendered once per (colors, size, orientation) and kept here
+GRADIENT_CACHE_BYTES = 1024 * 1024
+gradient_cache = resource.ImageCache(GRADIENT_CACHE_BYTES)
+
+
+def gradient_cache_stats():
+    """Hits, misses, evictions etc. of the gradient cache."""
+    return gradient_cache.stats()
+
+
+def _render_gradient(a, b, size, vertical):
+    """A surface of size filled with a gradient from color a to b.
+
+    The colors are computed for a one pixel wide strip which is then
+    scaled up.
+    """
+    w, h = size
+    n = h if vertical else w
+    rate = (float(b[0] - a[0]) / n,
+            float(b[1] - a[1]) / n,
+            float(b[2] - a[2]) / n)
+
+    strip = pygame.Surface((1, n) if vertical else (n, 1))
+    for i in range(n):
+        color = (int(min(max(a[0] + (rate[0] * i), 0), 255)),
+                 int(min(max(a[1] + (rate[1] * i), 0), 255)),
+                 int(min(max(a[2] + (rate[2] * i), 0), 255)))
+        strip.set_at((0, i) if vertical else (i, 0), color)
+    return pygame.transform.scale(strip, size)
+
 
 def fill_gradient(surface, color, gradient,
                   rect=None, vertical=True, forward=True):
@@ -27,43 +60,30 @@ def fill_gradient(surface, color, gradient,
         True=forward; False=reverse
 
     See http://www.pygame.org/wiki/GradientCode
+
+    The gradient is rendered once and then taken from gradient_cache.
     """
 
     if rect is None:
         rect = surface.get_rect()
+    rect = pygame.Rect(rect)
 
-    x1, x2 = rect.left, rect.right
-    y1, y2 = rect.top, rect.bottom
-
-    if vertical:
-        h = y2 - y1
-    else:
-        h = x2 - x1
-
-    assert h > 0
+    assert (rect.h if vertical else rect.w) > 0
+    if rect.w <= 0 or rect.h <= 0:
+        return
 
     if forward:
         a, b = color, gradient
     else:
         b, a = color, gradient
 
-    rate = (float(b[0] - a[0]) / h,
-            float(b[1] - a[1]) / h,
-            float(b[2] - a[2]) / h)
-
-    fn_line = pygame.draw.line
-    if vertical:
-        for line in range(y1, y2):
-            color = (min(max(a[0] + (rate[0] * (line - y1)), 0), 255),
-                     min(max(a[1] + (rate[1] * (line - y1)), 0), 255),
-                     min(max(a[2] + (rate[2] * (line - y1)), 0), 255))
-            fn_line(surface, color, (x1, line), (x2, line))
-    else:
-        for col in range(x1, x2):
-            color = (min(max(a[0] + (rate[0] * (col - x1)), 0), 255),
-                     min(max(a[1] + (rate[1] * (col - x1)), 0), 255),
-                     min(max(a[2] + (rate[2] * (col - x1)), 0), 255))
-            fn_line(surface, color, (col, y1), (col, y2))
+    key = ((tuple(a[:3]), tuple(b[:3])), rect.size, vertical)
+    gradient_surface = gradient_cache.get(key)
+    if gradient_surface is None:
+        gradient_surface = _render_gradient(a, b, rect.size, vertical)
+        gradient_cache.put(key, gradient_surface)
+
+    surface.blit(gradient_surface, rect.topleft)
 
 
 def fillrect(surface, color, rect, vertical=True):
@@ -3,15 +3,133 @@ import pkg_resources
 
 import weakref
 import logging
+import threading
+from collections import OrderedDict
 
 
 logger = logging.getLogger(__name__)
 
 
+class ImageCache(object):
+    """A bounded least-recently-used cache of image surfaces.
+
+    get_image keys images by (path, size, pixel format), size being
+    None for the image as loaded; other users use other tuples of
+    (what, size, ...). The total size of the cached pixel data is
+    kept below max_bytes by dropping the least recently used images.
+    Pinned images are never dropped (but count against the budget).
+
+    hits, misses, evictions
+
+        Counters for lookups that found an image, lookups that did
+        not and images dropped to stay within the budget.
+
+    The cache may be used from several threads.
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._images = OrderedDict()   # least recently used first
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def get(self, key):
+        """The cached image for key or None; counts a hit or miss."""
+        with self._lock:
+            try:
+                img = self._images.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._images[key] = img
+            self.hits += 1
+            return img
+
+    def put(self, key, img, pin=False):
+        """Cache img for key; pinned at once if pin is set."""
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.bytes -= _image_bytes(old)
+            self._images[key] = img
+            self.bytes += _image_bytes(img)
+            if pin:
+                self._pinned.add(key)
+            self._evict()
+
+    def pin(self, key):
+        """Pin the image cached for key; False if there is none."""
+        with self._lock:
+            if key not in self._images:
+                return False
+            self._pinned.add(key)
+            return True
+
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict()
+
+    def clear(self):
+        """Drop all images that are not pinned."""
+        with self._lock:
+            for key in list(self._images):
+                if key not in self._pinned:
+                    self.bytes -= _image_bytes(self._images.pop(key))
+
+    def stats(self):
+        return dict(images=len(self._images), bytes=self.bytes,
+                    max_bytes=self.max_bytes, pinned=len(self._pinned),
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions)
+
+    def _evict(self):
+        if self.bytes <= self.max_bytes:
+            return
+        for key in list(self._images):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in self._pinned:
+                continue
+            self.bytes -= _image_bytes(self._images.pop(key))
+            self.evictions += 1
+            logger.debug('evicted image %s %s' % (key[0], key[1]))
+
+
+def _image_bytes(img):
+    return img.get_width() * img.get_height() * img.get_bytesize()
+
+
+# ~30 full screen (320x215) covers
+IMAGE_CACHE_BYTES = 8 * 1024 * 1024
+
+# pixel formats images are cached in
+LOADED = 'loaded'       # from the PNG: display format, per-pixel alpha
+                        # only if it has transparent pixels
+DISPLAY = 'display'     # display format, opaque
+
+
 font_cache = weakref.WeakValueDictionary()
-image_cache = weakref.WeakValueDictionary()
+image_cache = ImageCache(IMAGE_CACHE_BYTES)
 sound_cache = weakref.WeakValueDictionary()
 
+# cache key of each cached image, for scale_image
+_image_keys = weakref.WeakKeyDictionary()
+
+# image directory -> ArtStore with compiled versions of its images
+art_stores = {}
+
 
 package_name = 'pygameui'
 
@@ -41,29 +159,144 @@ def get_font(size, use_bold=False):
 # TODO update this to support multiple search paths
 
 
-def get_image(name,path=None):
+def _image_path(name, path):
+    if path is None:
+        path = 'resources/images/%s.png' % name
+        return pkg_resources.resource_filename(package_name, path)
+    return path + name + '.png'
+
+
+def add_art_store(store):
+    """Let get_image use the compiled images of an artstore.ArtStore."""
+    art_stores[store.src_dir] = store
+
+
+def _get_compiled_image(name, path, size):
+    store = art_stores.get(path)
+    if store is None or store.size != size:
+        return None
+    key = (_image_path(name, path), size, DISPLAY)
+    img = image_cache.get(key)
+    if img is None:
+        img = store.load(name)
+        if img is not None:
+            image_cache.put(key, img)
+            _image_keys[img] = key
+    return img
+
+
+def _load_image(path):
     try:
-        img = image_cache[name]
-    except KeyError:
-        if path == None:
-            path = 'resources/images/%s.png' % name
-            path = pkg_resources.resource_filename(package_name, path)
-        else:
-            path = path + name + '.png'
-        try:
-            logger.debug('loading image %s' % path)
-            img = pygame.image.load(path)
-        except pygame.error, e:
-            logger.warn('failed to load image: %s: %s' % (path, e))
-            img = None
-        else:
-            img = img.convert_alpha()
-            image_cache[path] = img
+        logger.debug('loading image %s' % path)
+        img = pygame.image.load(path)
+    except (pygame.error, IOError), e:
+        logger.warn('failed to load image: %s: %s' % (path, e))
+        return None
+    if _has_transparency(img):
+        return img.convert_alpha()
+    return img.convert()
+
+
+def _has_transparency(img):
+    if img.get_colorkey() is not None:
+        return True
+    if not img.get_flags() & pygame.SRCALPHA:
+        return False
+    # many PNGs have an alpha channel without using it
+    w, h = img.get_size()
+    return pygame.mask.from_surface(img, 254).count() < w * h
+
+
+def _smoothscale(image, size):
+    if image.get_bitsize() in (24, 32):
+        return pygame.transform.smoothscale(image, size)
+    # smoothscale only handles 24 and 32 bit, e.g. not 16 bit displays
+    scaled = pygame.transform.smoothscale(image.convert(32), size)
+    return scaled.convert(image)
+
+
+def get_image(name, path=None, size=None):
+    """Load (or get from image_cache) the image `name`.png.
+
+    path
+
+        directory (with trailing slash) to load the image from;
+        default is the package's image resources.
+
+    size
+
+        if given, the image scaled to this size.
+
+    Images are converted to the display's pixel format, with per-pixel
+    alpha only if they have transparent pixels. A scaled image is cached
+    without the full size image it was scaled from, unless that was
+    cached already.
+
+    If an art store was added for path (see add_art_store) and has the
+    image at the requested size, the compiled (opaque, display format)
+    image is returned instead.
+
+    Returns None if the image cannot be loaded.
+
+    """
+    if size is not None:
+        size = tuple(size)
+        img = _get_compiled_image(name, path, size)
+        if img is not None:
+            return img
+    path = _image_path(name, path)
+    key = (path, size, LOADED)
+    img = image_cache.get(key)
+    if img is not None:
+        return img
+    if size is not None:
+        # large covers at full size would crowd the scaled images
+        # actually shown out of the cache
+        img = image_cache.get((path, None, LOADED))
+        if img is not None and img.get_size() == size:
+            return img
+    if img is None:
+        img = _load_image(path)
+        if img is None:
+            return None
+    if size is not None and img.get_size() != size:
+        img = _smoothscale(img, size)
+    image_cache.put(key, img)
+    _image_keys[img] = key
+    return img
+
+
+def pin_image(name, path=None, size=None):
+    """Like get_image but the image is kept in image_cache for good."""
+    img = get_image(name, path, size)
+    if img is not None:
+        # (re)cached and pinned in one go: it may be evicted already
+        image_cache.put(_image_keys[img], img, pin=True)
     return img
 
 
+def unpin_image(img):
+    """Allow an image returned by pin_image to be evicted again."""
+    key = _image_keys.get(img)
+    if key is not None:
+        image_cache.unpin(key)
+
+
 def scale_image(image, size):
-    return pygame.transform.smoothscale(image, size)
+    """Scale image to size; scaled versions of cached images are cached."""
+    size = tuple(size)
+    if image.get_size() == size:
+        return image
+    key = _image_keys.get(image)
+    if key is None:
+        return _smoothscale(image, size)
+    scaled_key = (key[0], size, key[2])
+    scaled = image_cache.get(scaled_key)
+    if scaled is None:
+        scaled = _smoothscale(image, size)
+        image_cache.put(scaled_key, scaled)
+        _image_keys[scaled] = scaled_key
+    return scaled
 
 
 def get_sound(name):
@@ -29,12 +29,43 @@ def pop():
     focus.set(None)
 
 
+# Above this many separate damage rects, just redraw their bounding box.
+MAX_DAMAGE_RECTS = 16
+
+
 class Scene(view.View):
-    """A view that takes up the entire window content area."""
+    """A view that takes up the entire window content area.
+
+    The scene collects the damage (changed areas, in window coordinates)
+    reported by its views; see `View.set_needs_display`.
+    """
 
     def __init__(self):
+        self.damaged_rects = []
         view.View.__init__(self, window.rect)
 
+    def add_damage(self, rect):
+        rect = rect.clip(self.frame)
+        if rect.w == 0 or rect.h == 0:
+            return
+        for index, other in enumerate(self.damaged_rects):
+            if other.contains(rect):
+                return
+            if other.colliderect(rect):
+                del self.damaged_rects[index]
+                self.add_damage(other.union(rect))
+                return
+        self.damaged_rects.append(rect)
+        if len(self.damaged_rects) > MAX_DAMAGE_RECTS:
+            self.damaged_rects = [rect.unionall(self.damaged_rects)]
+
+    def take_damage(self):
+        """Return the list of damaged rects and start a fresh one."""
+        view.invalidate_transforms()
+        self.damage_moved_children()
+        rects, self.damaged_rects = self.damaged_rects, []
+        return rects
+
     def key_down(self, key, code):
         import pygame
 
@@ -44,5 +75,9 @@ class Scene(view.View):
     def exited(self):
         pass
 
+    def presented(self):
+        """Called after a frame of this scene was sent to the display."""
+        pass
+
     def entered(self):
         self.stylize()
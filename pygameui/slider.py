@@ -99,6 +99,7 @@ class SliderView(view.View):
 
         self._value = max(self.low, min(self.high, val))
         self.track.value_percent = (val - self.low) / (self.high - self.low)
+        self.track.set_needs_display()
 
         if update_thumb:
             self._update_thumb()
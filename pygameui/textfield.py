@@ -35,6 +35,8 @@ class TextField(view.View):
         self.on_return = callback.Signal()
         self.on_text_change = callback.Signal()
 
+        self._blink_phase = None
+
     def layout(self):
         self.label.topleft = self.padding
         r_before = self.label.frame.right
@@ -84,6 +86,23 @@ class TextField(view.View):
         elif self.secure:
             self.label.text = '*' * len(self.text)
 
+    def update(self, dt):
+        view.View.update(self, dt)
+        if self.has_focus() and self.blink_cursor:
+            phase = pygame.time.get_ticks() / self.cursor_blink_duration % 2
+            if phase != self._blink_phase:
+                self._blink_phase = phase
+                self.set_needs_display()
+
+    def update_interval(self):
+        interval = view.View.update_interval(self)
+        if self.has_focus() and self.blink_cursor:
+            duration = self.cursor_blink_duration
+            blink = (duration - pygame.time.get_ticks() % duration) / 1000.0
+            if interval is None or blink < interval:
+                interval = blink
+        return interval
+
     def draw(self):
         if not view.View.draw(self) or not self.has_focus():
             return False
@@ -67,6 +67,11 @@ class Theme(object):
 
     def __init__(self):
         self._styles = {}
+        self._resolved = {}   # (class, state, base_name) -> style dict
+
+    def invalidate(self):
+        """Forget all resolved styles; done whenever a style is set."""
+        self._resolved.clear()
 
     def set(self, class_name, state, key, value):
         """Set a single style value for a view class and state.
@@ -95,6 +100,7 @@ class Theme(object):
         """
         self._styles.setdefault(class_name, {}).setdefault(state, {})
         self._styles[class_name][state][key] = value
+        self.invalidate()
 
     def get_dict_for_class(self, class_name, state=None, base_name='View'):
         """The style dict for a given class and state.
@@ -111,7 +117,19 @@ class Theme(object):
         style definitions, giving precedence to the non-'normal'
         style definitions.
 
+        The resolved dict is cached per (class, state) and shared by all
+        callers until the theme changes; do not modify it.
+
         """
+        if state is None:
+            state = 'normal'
+
+        cache_key = (class_name, state, base_name)
+        try:
+            return self._resolved[cache_key]
+        except KeyError:
+            pass
+
         classes = []
         klass = class_name
 
@@ -121,9 +139,6 @@ class Theme(object):
                 break
             klass = klass.__bases__[0]
 
-        if state is None:
-            state = 'normal'
-
         style = {}
 
         for klass in classes:
@@ -146,6 +161,7 @@ class Theme(object):
             style = dict(chain(state_styles.iteritems(),
                                style.iteritems()))
 
+        self._resolved[cache_key] = style
         return style
 
     def get_dict(self, obj, state=None, base_name='View'):
@@ -180,6 +196,7 @@ def use_theme(theme):
     """
     global current
     current = theme
+    current.invalidate()
     import scene
     if scene.current is not None:
         scene.current.stylize()
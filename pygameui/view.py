@@ -1,3 +1,5 @@
+import bisect
+
 import pygame
 
 import render
@@ -9,6 +11,22 @@ import focus
 import kvc
 
 
+_MISSING = object()
+
+# bumped to invalidate the cached window positions of all views
+_transforms_generation = 0
+
+
+def invalidate_transforms():
+    """Forget the cached window positions of all views.
+
+    pygameui calls this before each input event and each frame; call it
+    when converting points of views moved since then.
+    """
+    global _transforms_generation
+    _transforms_generation += 1
+
+
 class View(object):
     """A rectangular portion of the window.
 
@@ -38,6 +56,15 @@ class View(object):
     All mouse points passed to event methods and to slots are in local
     view coordinates. Use `to_parent` and `to_window` to convert.
 
+    A view with `cache_layer` set keeps what it drew on its surface and
+    is only redrawn where something in it changed (see
+    `set_needs_display`); otherwise its parent just blits the surface.
+    Meant for mostly static subtrees such as a background image.
+
+    A view with `spatial_index` set finds the child under a point (see
+    `hit`) by bisecting its children sorted by top edge instead of trying
+    each, which keeps hit testing fast in long vertical lists.
+
     """
 
     def __init__(self, frame=None):
@@ -48,9 +75,20 @@ class View(object):
 
         self._state = 'normal'
         self._enabled = True
-        self.hidden = False
+        self._hidden = False
         self.draggable = False
 
+        self._drawn_frame = None
+
+        self._cache_layer = False
+        self._layer_damage = None   # local area of the layer to redraw
+
+        self.spatial_index = False
+        self._hit_index = None
+
+        self._window_topleft = None
+        self._window_generation = None
+
         self.shadow_image = None
 
         self.on_focused = callback.Signal()
@@ -81,14 +119,134 @@ class View(object):
             shadow_size = theme.current.shadow_size
             shadowed_frame_size = (self.frame.w + shadow_size,
                                    self.frame.h + shadow_size)
-            self.surface = pygame.Surface(
-                shadowed_frame_size, pygame.SRCALPHA, 32)
+            self.surface = self.create_surface(shadowed_frame_size)
             shadow_image = resource.get_image('shadow')
             self.shadow_image = resource.scale_image(shadow_image,
                                                      shadowed_frame_size)
         else:
-            self.surface = pygame.Surface(self.frame.size, pygame.SRCALPHA, 32)
+            self.surface = self.create_surface(self.frame.size)
             self.shadow_image = None
+        self._hit_index = None
+        self.set_needs_display()
+
+    @property
+    def opaque(self):
+        """True if the background covers the view without transparency.
+
+        Shadowed views are never opaque.
+        """
+        if getattr(self, 'shadowed', False):
+            return False
+        color = getattr(self, 'background_color', None)
+        if color is None:
+            return False
+        for c in (color if len(color) == 2 else (color,)):   # gradient?
+            if len(c) > 3 and c[3] < 255:
+                return False
+        return True
+
+    def create_surface(self, size):
+        """Return a new surface of size for the view to draw on.
+
+        Opaque views get the display's pixel format, which blits without
+        per-pixel alpha blending or a format conversion. The others get
+        32 bit surfaces with per-pixel alpha.
+        """
+        if self.opaque and pygame.display.get_surface() is not None:
+            return pygame.Surface(size)
+        return pygame.Surface(size, pygame.SRCALPHA, 32)
+
+    @property
+    def hidden(self):
+        return self._hidden
+
+    @hidden.setter
+    def hidden(self, yesno):
+        if self._hidden != yesno:
+            self._hidden = yesno
+            if self.parent is not None:
+                self.parent.set_needs_display(self.damage_frame())
+
+    @property
+    def cache_layer(self):
+        return self._cache_layer
+
+    @cache_layer.setter
+    def cache_layer(self, yesno):
+        self._cache_layer = yesno
+        self._layer_damage = None
+        if yesno and self.frame is not None:
+            self._invalidate_layer(pygame.Rect((0, 0), self.frame.size))
+
+    def _invalidate_layer(self, rect):
+        if self._layer_damage is None:
+            self._layer_damage = pygame.Rect(rect)
+        else:
+            self._layer_damage.union_ip(rect)
+
+    def damage_frame(self, frame=None):
+        """The area of the parent covered by this view (incl. shadow)."""
+        if frame is None:
+            frame = self.frame
+        if getattr(self, 'shadowed', False):
+            shadow_size = theme.current.shadow_size
+            return pygame.Rect(frame.left - shadow_size // 2,
+                               frame.top - shadow_size // 2,
+                               frame.w + shadow_size,
+                               frame.h + shadow_size)
+        return pygame.Rect(frame)
+
+    def set_needs_display(self, rect=None):
+        """Mark an area of this view as changed so it gets redrawn.
+
+        rect is in local view coordinates; default is the whole view.
+        The area is converted to window coordinates and handed to the
+        root view (usually a Scene) via `add_damage`. The cached layers
+        on the way (see `cache_layer`) are told to redraw the area.
+        """
+        if rect is None:
+            rect = pygame.Rect((0, 0), self.frame.size)
+            if self.parent is not None:
+                if self._cache_layer:
+                    self._invalidate_layer(rect)
+                self.parent.set_needs_display(self.damage_frame())
+                return
+        rect = pygame.Rect(rect)
+        curr = self
+        while True:
+            if curr._cache_layer:
+                curr._invalidate_layer(rect)
+            if curr.parent is None:
+                break
+            rect.move_ip(curr.frame.topleft)
+            curr = curr.parent
+        curr.add_damage(rect)
+
+    def add_damage(self, rect):
+        """Receives damage (in window coordinates) when this is a root view.
+
+        Views that are not attached to a scene have nobody to show their
+        content to, so by default the damage is dropped.
+        """
+        pass
+
+    def damage_moved_children(self):
+        """Damage the old and new area of any child whose frame changed.
+
+        Frames are often mutated in place (e.g. `frame.top += 1`) so moves
+        are detected by comparing against the frame last seen here.
+        """
+        for child in self.children:
+            if child._drawn_frame != child.frame:
+                self._hit_index = None
+                if not child.hidden:
+                    if child._drawn_frame is not None:
+                        self.set_needs_display(
+                            child.damage_frame(child._drawn_frame))
+                    self.set_needs_display(child.damage_frame())
+                child._drawn_frame = pygame.Rect(child.frame)
+            if not child.hidden:
+                child.damage_moved_children()
 
     def size_to_fit(self):
         rect = self.frame
@@ -101,6 +259,22 @@ class View(object):
         for child in self.children:
             child.update(dt)
 
+    def update_interval(self):
+        """Seconds until this view or one of its children needs `update`.
+
+        0 asks for an update every frame (i.e. the view is animating);
+        None means nothing happens until the next event. Views with
+        timers or animations override this; hidden views are ignored.
+        """
+        interval = None
+        for child in self.children:
+            if not child.hidden:
+                child_interval = child.update_interval()
+                if child_interval is not None and (interval is None or
+                                                   child_interval < interval):
+                    interval = child_interval
+        return interval
+
     def to_parent(self, point):
         return (point[0] + self.frame.topleft[0],
                 point[1] + self.frame.topleft[1])
@@ -109,22 +283,28 @@ class View(object):
         return (point[0] - self.frame.topleft[0],
                 point[1] - self.frame.topleft[1])
 
+    def window_topleft(self):
+        """The window position of the view's top left corner.
+
+        Cached until the next `invalidate_transforms`.
+        """
+        if self._window_generation != _transforms_generation:
+            x, y = self.frame.topleft
+            if self.parent is not None:
+                parent_x, parent_y = self.parent.window_topleft()
+                x += parent_x
+                y += parent_y
+            self._window_topleft = (x, y)
+            self._window_generation = _transforms_generation
+        return self._window_topleft
+
     def from_window(self, point):
-        curr = self
-        ancestors = [curr]
-        while curr.parent:
-            ancestors.append(curr.parent)
-            curr = curr.parent
-        for a in reversed(ancestors):
-            point = a.from_parent(point)
-        return point
+        x, y = self.window_topleft()
+        return (point[0] - x, point[1] - y)
 
     def to_window(self, point):
-        curr = self
-        while curr:
-            point = curr.to_parent(point)
-            curr = curr.parent
-        return point
+        x, y = self.window_topleft()
+        return (point[0] + x, point[1] + y)
 
     def mouse_up(self, button, point):
         self.on_mouse_up(self, button, point)
@@ -215,24 +395,59 @@ class View(object):
         # do children first in case parent needs to override their style
         for child in self.children:
             child.stylize()
-        style = theme.current.get_dict(self)
-        for key, val in style.iteritems():
-            kvc.set_value_for_keypath(self, key, val)
+        self.apply_style(theme.current.get_dict(self))
         self.layout()
 
+    def apply_style(self, style):
+        """Set the style attributes of the style dict on this instance.
+
+        Attributes which already have the value are left alone. Key
+        paths into other objects (e.g. 'title_label.text_color') are
+        always set since the child may have been restyled meanwhile.
+        """
+        for key, val in style.iteritems():
+            if '.' in key or '[' in key:
+                kvc.set_value_for_keypath(self, key, val)
+            elif getattr(self, key, _MISSING) != val:
+                setattr(self, key, val)
+
     def draw(self):
-        """Do not call directly."""
+        """Do not call directly.
+
+        Only the clip area of the view's surface is redrawn; children
+        entirely outside of it are skipped and keep their last content.
+        Cached layers are only redrawn where they were invalidated.
+        """
 
         if self.hidden:
             return False
 
+        if (not self.surface.get_flags() & pygame.SRCALPHA and
+            not self.opaque):
+            # the background was made transparent without a relayout; the
+            # new surface has no clip so it is drawn completely
+            self.surface = self.create_surface(self.surface.get_size())
+
+        clip = self.surface.get_clip()
+
         if self.background_color is not None:
             render.fillrect(self.surface, self.background_color,
                             rect=pygame.Rect((0, 0), self.frame.size))
 
         for child in self.children:
             if not child.hidden:
-                child.draw()
+                area = clip.clip(child.damage_frame())
+                if area.w == 0 or area.h == 0:
+                    continue
+
+                if not child._cache_layer:
+                    area.move_ip(-child.frame.left, -child.frame.top)
+                    child.surface.set_clip(area)
+                    child.draw()
+                elif child._layer_damage is not None:
+                    child.surface.set_clip(child._layer_damage)
+                    child._layer_damage = None
+                    child.draw()
 
                 topleft = child.frame.topleft
 
@@ -289,13 +504,53 @@ class View(object):
         local_pt = (pt[0] - self.frame.topleft[0],
                     pt[1] - self.frame.topleft[1])
 
-        for child in reversed(self.children):   # front to back
+        if self.spatial_index:
+            children = self._hit_candidates(local_pt)
+        else:
+            children = reversed(self.children)
+
+        for child in children:   # front to back
             hit_view = child.hit(local_pt)
             if hit_view is not None:
                 return hit_view
 
         return self
 
+    def invalidate_hit_index(self):
+        """Rebuild the spatial index on the next `hit`.
+
+        Changes of the children and their frames are noticed by the
+        next frame at the latest (see `damage_moved_children`); call
+        this after moving children to hit test them before.
+        """
+        self._hit_index = None
+
+    def _hit_candidates(self, pt):
+        """The children whose frame contains pt, front to back."""
+        if self._hit_index is None:
+            order = sorted(range(len(self.children)),
+                           key=lambda i: self.children[i].frame.top)
+            tops = []
+            reach = []   # furthest bottom edge of the children so far
+            for i in order:
+                frame = self.children[i].frame
+                tops.append(frame.top)
+                reach.append(max(reach[-1], frame.bottom) if reach
+                             else frame.bottom)
+            self._hit_index = (tops, reach, order)
+
+        tops, reach, order = self._hit_index
+        y = pt[1]
+        found = []
+        i = bisect.bisect_right(tops, y) - 1
+        while i >= 0 and reach[i] > y:
+            child = self.children[order[i]]
+            if child.frame.collidepoint(pt):
+                found.append(order[i])
+            i -= 1
+        found.sort(reverse=True)
+        return [self.children[j] for j in found]
+
     def center(self):
         if self.parent is not None:
             self.frame.center = (self.parent.frame.w // 2,
@@ -305,17 +560,23 @@ class View(object):
         assert child is not None
         self.rm_child(child)
         self.children.append(child)
+        self._hit_index = None
         child.parent = self
+        child._drawn_frame = None
         child.parented()
         import scene
         if scene.current is not None:
             child.stylize()
+        self.set_needs_display(child.damage_frame())
 
     def rm_child(self, child):
         for index, ch in enumerate(self.children):
             if ch == child:
+                if not ch.hidden:
+                    self.set_needs_display(ch.damage_frame())
                 ch.orphaned()
                 del self.children[index]
+                self._hit_index = None
                 break
 
     def rm(self):
@@ -344,9 +605,13 @@ class View(object):
             ch = self.parent.children
             index = ch.index(self)
             ch[-1], ch[index] = ch[index], ch[-1]
+            self.parent._hit_index = None
+            self.set_needs_display()
 
     def move_to_back(self):
         if self.parent is not None:
             ch = self.parent.children
             index = ch.index(self)
             ch[0], ch[index] = ch[index], ch[0]
+            self.parent._hit_index = None
+            self.set_needs_display()
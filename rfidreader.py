@@ -1,26 +1,224 @@
 import logging
+import threading
 import time
-from pirc522 import RFID
+import tracing
 
 #init Logging
 logger = logging.getLogger()
 
+# detection modes of the RFIDReader
+POLL = 'poll'  # poll the reader, adapting the interval to card activity
+IRQ = 'irq'    # block until the reader's IRQ line signals a tag
+
+# card presence events
+ARRIVED = 'arrived'   # a card was put on the reader
+PRESENT = 'present'   # the card is still on the reader
+REMOVED = 'removed'   # the card was taken off the reader
+
+
+class PiRC522Backend(object):
+    """MFRC522 reader on the Pi's SPI bus (via pirc522)"""
+
+    def __init__(self, dev='/dev/spidev1.0', pin_rst=37, pin_irq=None):
+        """
+        Constructor
+
+        :param dev: SPI device; spidev1.0 requires /boot/config.txt modification: dtparam=spi=on dtoverlay=spi1-1cs,cs0_pin=16
+        :param pin_rst: board pin of the reader's RST line
+        :param pin_irq: board pin the reader's IRQ line is wired to, None if it is not connected (no IRQ mode then)
+        """
+        from pirc522 import RFID  # only available on the Pi
+        if pin_irq is None:
+            self.rdr = RFID(dev=dev, pin_rst=pin_rst)
+        else:
+            self.rdr = RFID(dev=dev, pin_rst=pin_rst, pin_irq=pin_irq)
+        self.has_irq = pin_irq is not None
+        self.aborted = False
+
+    def request(self):
+        return self.rdr.request()
+
+    def anticoll(self):
+        return self.rdr.anticoll()
+
+    def wait_for_tag(self):
+        """
+        Block until the reader raises its IRQ for a tag in the field
+
+        :return: True if a tag was signalled, False if the wait was aborted
+        """
+        self.rdr.wait_for_tag()
+        return not self.aborted
+
+    def abort(self):
+        """
+        Make a pending wait_for_tag() return. Without an IRQ line (POLL mode) nothing waits for a tag.
+
+        :return:
+        """
+        self.aborted = True
+        irq = getattr(self.rdr, 'irq', None)
+        if self.has_irq and irq is not None:
+            irq.set()
+
+    def cleanup(self):
+        self.rdr.cleanup()
+
+
+class SimulatedBackend(object):
+    """
+    Reader without hardware for testing on a plain Linux box: cards are put on and taken off the reader
+    by calling place() and remove(). Counts the SPI transactions a real reader would have made.
+    """
+
+    def __init__(self, has_irq=True):
+        """
+        Constructor
+
+        :param has_irq: whether to simulate a connected IRQ line (IRQ mode)
+        """
+        self.has_irq = has_irq
+        self.uid = None
+        self.transactions = 0
+        self.aborted = False
+        self._changed = threading.Event()
+
+    def place(self, card_id):
+        """
+        Put a card on the reader
+
+        :param card_id: the card's 4 byte ID in dotted decimal format, e.g. "1.2.3.4"
+        :return:
+        """
+        uid = [int(b) for b in card_id.split(".")]
+        self.uid = uid + [uid[0] ^ uid[1] ^ uid[2] ^ uid[3]]
+        self._changed.set()
+
+    def remove(self):
+        """
+        Take the card off the reader
+
+        :return:
+        """
+        self.uid = None
+
+    def request(self):
+        self.transactions += 1
+        if self.uid is None:
+            return (True, None)
+        return (False, 0x10)
+
+    def anticoll(self):
+        self.transactions += 1
+        if self.uid is None:
+            return (True, [])
+        return (False, list(self.uid))
+
+    def wait_for_tag(self):
+        """
+        Block until a card is on the reader
+
+        :return: True if a card is on the reader, False if the wait was aborted
+        """
+        while self.uid is None and not self.aborted:
+            self._changed.wait()
+            self._changed.clear()
+        return not self.aborted
+
+    def abort(self):
+        self.aborted = True
+        self._changed.set()
+
+    def cleanup(self):
+        pass
+
+
+class CardPresence(object):
+    """
+    Turns the raw reads of the reader into card presence events.
+
+    Reads of a card resting on the reader fail now and then, so a card only counts as removed after it
+    was not read for `debounce` seconds. A different card replaces the current one at once.
+    """
+
+    def __init__(self, debounce=0.5):
+        """
+        Constructor
+
+        :param debounce: seconds without a successful read before a card counts as removed
+        """
+        self.debounce = debounce
+        self.card = None
+        self.last_seen = 0.0
+
+    def update(self, card_id, now):
+        """
+        Feed the result of one read
+
+        :param card_id: ID of the card read, None if no card was read
+        :param now: monotonic time of the read
+        :return: list of (event, card_id) tuples, events are ARRIVED, PRESENT and REMOVED
+        """
+        events = []
+        if card_id is None:
+            if self.card is not None and now - self.last_seen >= self.debounce:
+                events.append((REMOVED, self.card))
+                self.card = None
+            return events
+
+        if card_id == self.card:
+            events.append((PRESENT, card_id))
+        else:
+            if self.card is not None:
+                events.append((REMOVED, self.card))
+            self.card = card_id
+            events.append((ARRIVED, card_id))
+        self.last_seen = now
+        return events
+
+
 class RFIDReader():
-    """Simple RFID Reader running in a thread"""
+    """
+    Simple RFID Reader running in a thread
+
+    In IRQ mode the thread sleeps until the reader signals a tag. Without an IRQ line it polls: quickly
+    (poll_min) while or right after a card was seen, then backing off by poll_backoff per empty poll up to
+    poll_max. While a card is on the reader it is polled in both modes, to notice its removal.
 
-    def __init__(self, emscene, player):
+    Only a card arriving plays its playlist; a card resting on the reader causes no MPD calls. Taking
+    the card off pauses playback if pause_on_remove is set, putting the same card back resumes it.
+    """
+
+    poll_min = 0.1       # poll interval after card activity (s)
+    poll_max = 0.3       # poll interval when idle (s)
+    poll_backoff = 1.5   # interval growth per poll without a card
+
+    def __init__(self, emscene, player, backend=None, mode=None, debounce=0.5, pause_on_remove=False):
         """
         Constructor
 
         :param emscene: Emma Music Player UI Scene
         :param player:  Lockable MPDClient Instance
+        :param backend: reader hardware (PiRC522Backend by default) or a SimulatedBackend
+        :param mode: IRQ or POLL, by default IRQ if the backend has an IRQ line
+        :param debounce: seconds a card must be unreadable before it counts as removed
+        :param pause_on_remove: pause playback when the card is taken off the reader
         """
         self.emscene = emscene
         self.player = player
-        self.rdr = RFID(dev='/dev/spidev1.0',pin_rst=37) #requires /boot/config.txt modification: dtparam=spi=on dtoverlay=spi1-1cs,cs0_pin=16
+        self.backend = backend if backend is not None else PiRC522Backend()
+        if mode is None:
+            mode = IRQ if self.backend.has_irq else POLL
+        self.mode = mode
+        self.interval = self.poll_min
+        self.polls = 0
+        self.presence = CardPresence(debounce)
+        self.pause_on_remove = pause_on_remove
+        self.paused_card = None  # card whose removal paused playback
+        self.card_listeners = []
 
         self.terminated = False
-        
+
     def terminate(self):
         """
         Stop this thread
@@ -28,24 +226,112 @@ class RFIDReader():
         :return:
         """
         self.terminated = True
-        self.rdr.cleanup()
-        
+        self.backend.abort()
+        self.backend.cleanup()
+
+    def read_card(self):
+        """
+        Ask the reader for a card in the field
+
+        :return: the card's ID in dotted decimal format, None if there is no card
+        """
+        self.polls += 1
+        (error, data) = self.backend.request()
+        if error:
+            return None
+        logger.debug("\nDetected: " + format(data, "02x"))
+
+        (error, uid) = self.backend.anticoll()
+        if error:
+            return None
+        logger.debug("Card read UID: "+str(uid[0])+","+str(uid[1])+","+str(uid[2])+","+str(uid[3]))
+        return str(uid[0])+"."+str(uid[1])+"."+str(uid[2])+"."+str(uid[3])
+
+    def add_card_listener(self, listener):
+        """
+        Register a function to be called on card presence events. Listeners are called from the reader thread.
+
+        :param listener: function taking the event (ARRIVED, PRESENT or REMOVED) and the card ID
+        :return:
+        """
+        self.card_listeners.append(listener)
+
+    def card_event(self, event, card_id):
+        """
+        React on a card presence event
+
+        :param event: ARRIVED, PRESENT or REMOVED
+        :param card_id: the 4 byte ID of the card in dotted decimal format
+        :return:
+        """
+        if event != PRESENT:
+            logger.debug("card %s %s" % (card_id, event))
+        if event == ARRIVED:
+            paused_card, self.paused_card = self.paused_card, None
+            if card_id == paused_card and card_id == self.player.current_playlistname and \
+                    self.player.state.status.get('state') == 'pause':
+                # the card paused playback when it was taken off - continue where it stopped
+                self.player.submit('pause', 0)
+            else:
+                tracing.begin(card_id, "anticoll")  # trace time from card detection until the cover shows
+                self.player.play(card_id)
+        elif event == REMOVED and self.pause_on_remove:
+            if self.player.state.status.get('state') == 'play':
+                self.player.submit('pause', 1)
+                self.paused_card = card_id
+        for listener in self.card_listeners:
+            listener(event, card_id)
+
     def __call__(self):
         """
         Thread main loop
 
         :return:
         """
+        logger.debug("RFID reader in %s mode" % self.mode)
         while not self.terminated:
-            # Read channel 0 in single-ended mode using the settings above
-            (error, data) = self.rdr.request()
-            if not error:
-                logger.debug("\nDetected: " + format(data, "02x"))
-
-            (error, uid) = self.rdr.anticoll()
-            if not error:
-                logger.debug("Card read UID: "+str(uid[0])+","+str(uid[1])+","+str(uid[2])+","+str(uid[3]))
-                self.player.play(str(uid[0])+"."+str(uid[1])+"."+str(uid[2])+"."+str(uid[3]))
-                time.sleep(1.0)
-                
-            time.sleep(0.1)
+            if self.mode == IRQ and self.presence.card is None and not self.backend.wait_for_tag():
+                break
+
+            card_id = self.read_card()
+            for event, card in self.presence.update(card_id, tracing.monotonic()):
+                self.card_event(event, card)
+
+            if card_id is not None or self.presence.card is not None:
+                self.interval = self.poll_min
+            else:
+                self.interval = min(self.interval * self.poll_backoff, self.poll_max)
+            time.sleep(self.interval)
+
+
+if __name__ == '__main__':
+    # try the reader modes without hardware: type a card ID (e.g. 1.2.3.4) to put a card on the reader,
+    # an empty line to take it off and Ctrl-D to quit
+    import sys
+
+    class PrintingPlayer(object):
+        def play(self, card_id):
+            print("play %s" % card_id)
+
+    def print_event(event, card_id):
+        if event != PRESENT:
+            print("card %s %s" % (card_id, event))
+
+    logging.basicConfig(level=logging.INFO)
+    mode = sys.argv[1] if len(sys.argv) > 1 else IRQ
+    backend = SimulatedBackend(has_irq=(mode == IRQ))
+    reader = RFIDReader(None, PrintingPlayer(), backend, mode)
+    reader.add_card_listener(print_event)
+    thread = threading.Thread(target=reader)
+    thread.start()
+    start = time.time()
+    for line in iter(sys.stdin.readline, ''):
+        if line.strip():
+            backend.place(line.strip())
+        else:
+            backend.remove()
+    reader.terminate()
+    thread.join()
+    elapsed = time.time() - start
+    print("%d reads, %d SPI transactions in %.1fs (%.1f/s)" %
+          (reader.polls, backend.transactions, elapsed, backend.transactions / elapsed))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+tracing.py
+
+Simple latency tracing: a trace follows one action (e.g. a card tap) through several stages, each marked
+with a monotonic timestamp. The stages may be marked from different threads; they always belong to the
+trace begun last. Finished traces are kept in a ring buffer and can be dumped as JSON lines, one trace
+per line, either by calling dump() or by sending SIGUSR1 (see install_signal_handler).
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger()
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no time.monotonic - use clock_gettime(CLOCK_MONOTONIC) directly, or the elapsed
+    # real time of os.times() (10ms resolution) where that is not available. Neither jumps with the wall clock.
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        _clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+                                     use_errno=True).clock_gettime
+        _CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            """
+            :return: seconds since an arbitrary point in the past
+            """
+            ts = _timespec()
+            if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                return os.times()[4]
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    except (ImportError, OSError, AttributeError, TypeError):
+        def monotonic():
+            """
+            :return: seconds since an arbitrary point in the past
+            """
+            return os.times()[4]
+
+
+class Trace(object):
+    """
+    One traced action: a label and the (stage, monotonic timestamp) marks recorded for it
+    """
+
+    def __init__(self, trace_id, label):
+        """
+        Constructor
+
+        :param trace_id: number of the trace
+        :param label: what is traced (e.g. the card id)
+        """
+        self.trace_id = trace_id
+        self.label = label
+        self.wall_time = time.time()
+        self.marks = []
+        self.complete = False
+
+    def as_dict(self):
+        """
+        The trace with each stage's offset from the first mark and duration since the previous mark
+
+        :return: dictionary ready to be serialized as JSON
+        """
+        start = self.marks[0][1] if self.marks else 0.0
+        spans = []
+        prev = start
+        for stage, ts in self.marks:
+            spans.append({"stage": stage,
+                          "at_ms": round((ts - start) * 1000, 1),
+                          "duration_ms": round((ts - prev) * 1000, 1)})
+            prev = ts
+        return {"trace": self.trace_id,
+                "label": self.label,
+                "time": self.wall_time,
+                "complete": self.complete,
+                "total_ms": round((prev - start) * 1000, 1),
+                "spans": spans}
+
+
+class Tracer(object):
+    """
+    Records traces; finished traces go into a ring buffer of the given capacity
+    """
+
+    def __init__(self, capacity=100):
+        """
+        Constructor
+
+        :param capacity: number of finished traces to keep
+        """
+        self.traces = deque(maxlen=capacity)
+        self.current = None
+        self.next_id = 1
+        self._lock = threading.Lock()
+
+    def begin(self, label, stage="begin"):
+        """
+        Start a new trace (finishing the current one as incomplete) and mark its first stage
+
+        :param label: what is traced
+        :param stage: name of the first stage
+        :return:
+        """
+        ts = monotonic()
+        with self._lock:
+            if self.current is not None:
+                self.traces.append(self.current)
+            self.current = Trace(self.next_id, label)
+            self.current.marks.append((stage, ts))
+            self.next_id += 1
+
+    def mark(self, stage):
+        """
+        Mark a stage of the current trace (nothing is done if there is none)
+
+        :param stage: name of the stage reached
+        :return:
+        """
+        ts = monotonic()
+        with self._lock:
+            if self.current is not None:
+                self.current.marks.append((stage, ts))
+
+    def end(self, stage="end"):
+        """
+        Mark the last stage of the current trace and move it to the ring buffer
+
+        :param stage: name of the last stage
+        :return:
+        """
+        ts = monotonic()
+        with self._lock:
+            if self.current is not None:
+                self.current.marks.append((stage, ts))
+                self.current.complete = True
+                self.traces.append(self.current)
+                logger.debug("trace: %s" % json.dumps(self.current.as_dict()))
+                self.current = None
+
+    def dump(self, path):
+        """
+        Append all finished traces (and the current one) as JSON lines to a file and empty the ring buffer
+
+        :param path: file to append to
+        :return: number of traces written
+        """
+        with self._lock:
+            traces = list(self.traces)
+            self.traces.clear()
+            if self.current is not None:
+                traces.append(self.current)
+        with open(path, 'a') as f:
+            for trace in traces:
+                f.write(json.dumps(trace.as_dict()) + "\n")
+        logger.info("dumped %d traces to %s" % (len(traces), path))
+        return len(traces)
+
+
+# the tracer used by the player, reader and UI
+tracer = Tracer()
+
+
+def begin(label, stage="begin"):
+    tracer.begin(label, stage)
+
+
+def mark(stage):
+    tracer.mark(stage)
+
+
+def end(stage="end"):
+    tracer.end(stage)
+
+
+def dump(path):
+    return tracer.dump(path)
+
+
+def install_signal_handler(path, signum=signal.SIGUSR1):
+    """
+    Dump the traces to path whenever the process receives signum (SIGUSR1 by default).
+    The handler only wakes a dumper thread: it runs on the main thread, possibly while that holds the
+    tracer's lock (e.g. in end()), so dumping in the handler itself could deadlock.
+
+    :param path: file to append the traces to
+    :param signum: signal to react on
+    :return:
+    """
+    requested = threading.Event()
+
+    def dumper():
+        while True:
+            requested.wait()
+            requested.clear()
+            try:
+                tracer.dump(path)
+            except Exception as e:
+                logger.error("dumping traces failed: %s" % e)
+
+    thread = threading.Thread(target=dumper, name="trace-dump")
+    thread.daemon = True
+    thread.start()
+
+    def handler(signum, frame):
+        requested.set()
+
+    signal.signal(signum, handler)